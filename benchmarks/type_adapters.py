@@ -0,0 +1,77 @@
+"""
+Encode/decode throughput of column values, comparing the old string
+round-trip (str()/strftime on the way in, parsing on the way out) with
+native objects going through psycopg's binary adapters.
+
+Runs without a database:
+
+    $ uv run python benchmarks/type_adapters.py
+"""
+from datetime import date, datetime
+from decimal import Decimal
+import timeit
+import uuid
+
+from psycopg.adapt import PyFormat, Transformer
+from psycopg.pq import Format
+from psycopg.types.json import Jsonb
+
+from idli.internal import DATE_FMT
+
+
+N = 100_000
+
+SAMPLES = {
+    'INTEGER': 123456,
+    'DOUBLE PRECISION': 3.14159265358979,
+    'NUMERIC': Decimal('1234.5678'),
+    'VARCHAR': 'Ship this ORM',
+    'BOOLEAN': True,
+    'TIMESTAMP': datetime(2025, 12, 31, 23, 59, 59, 123456),
+    'DATE': date(2025, 12, 31),
+    'UUID': uuid.uuid4(),
+    'BYTEA': b'\x00\x01' * 64,
+    'JSONB': Jsonb({'status': 'todo', 'tags': ['a', 'b'], 'points': 3}),
+    'INTEGER[]': list(range(32)),
+}
+
+# How values used to be turned into strings, and how the strings were parsed back.
+STRING_ROUND_TRIP = {
+    'INTEGER': (str, int),
+    'DOUBLE PRECISION': (str, float),
+    'VARCHAR': (lambda x: x, lambda x: x),
+    'BOOLEAN': (str, lambda x: x.lower()=='true'),
+    'TIMESTAMP': (lambda x: x.strftime(DATE_FMT), lambda x: datetime.strptime(x, DATE_FMT)),
+    'UUID': (str, uuid.UUID),
+}
+
+
+def ops_per_sec(fn):
+    return N / timeit.timeit(fn, number=N)
+
+
+def main():
+    tx = Transformer()
+    print(f"{'type':<18}{'str encode':>14}{'str decode':>14}{'bin encode':>14}{'bin decode':>14}")
+
+    for name, value in SAMPLES.items():
+        dumper = tx.get_dumper(value, PyFormat.BINARY)
+        data = dumper.dump(value)
+        loader = tx.get_loader(dumper.oid, Format.BINARY)
+
+        bin_encode = ops_per_sec(lambda: dumper.dump(value))
+        bin_decode = ops_per_sec(lambda: loader.load(data))
+
+        if name in STRING_ROUND_TRIP:
+            to_str, from_str = STRING_ROUND_TRIP[name]
+            text = to_str(value)
+            str_encode = f'{ops_per_sec(lambda: to_str(value)):>14,.0f}'
+            str_decode = f'{ops_per_sec(lambda: from_str(text)):>14,.0f}'
+        else:
+            str_encode = str_decode = f"{'-':>14}"
+
+        print(f'{name:<18}{str_encode}{str_decode}{bin_encode:>14,.0f}{bin_decode:>14,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,5 +2,9 @@ from idli.connection import Connection
 from idli.helpers import (
     AutoInt,
     AutoUUID,
-    PrimaryKey
+    Partition,
+    PrimaryKey,
+    ShardKey
 )
+from idli.internal import register_type
+from idli.sharding import ShardedConnection
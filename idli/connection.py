@@ -1,7 +1,11 @@
 import atexit
+from datetime import date
 import inspect
+import os
 import re
-from typing import Optional, Union, get_args, get_type_hints
+import threading
+import weakref
+from typing import Optional, Union, get_args, get_origin, get_type_hints
 
 import psycopg
 from psycopg.rows import dict_row
@@ -11,53 +15,40 @@ from idli import model_methods
 from idli import sql_factory
 from idli.errors import *
 from idli.helpers import *
-from idli.internal import Column, Table
+from idli.internal import COLUMN_TYPES, Column, Table, server_default
+from idli.migrations import MigrationPlan
 
 
-class Connection:
+# Fork and exit hooks are registered once for the module and only hold weak
+# references, so connections and their pools can still be garbage collected.
+_connections = weakref.WeakSet()
 
-    def __init__(self, db_uri: str, sambar_dip: bool=False):
-        self._pool = ConnectionPool(db_uri, open=True)
-        atexit.register(self._pool.close)
-        
-        self._sambar_dip = sambar_dip
 
-        self.load_tables()
-        self.load_columns()
-        
+def _after_fork_in_child():
+    for connection in list(_connections):
+        connection._after_fork()
 
-    def exec_sql(self, *args):
-        with self._pool.connection() as conn:
-            return conn.execute(*args)
-            
-    
-    def exec_sql_to_dict_rows(self, *args):
-        with self._pool.connection() as conn:
-            cur = conn.cursor(row_factory = dict_row)
-            return cur.execute(*args)
 
+def _close_connections():
+    for connection in list(_connections):
+        connection.close()
 
-    def load_tables(self):
-        result = self.exec_sql_to_dict_rows(sql_factory.list_tables()).fetchall()
-        self.__db_tables__ = { row['table_name']: Table(row['table_name']) for row in result }
 
+os.register_at_fork(after_in_child=_after_fork_in_child)
+atexit.register(_close_connections)
 
-    def load_columns(self):
-        result = self.exec_sql_to_dict_rows(sql_factory.list_columns()).fetchall()
-        for row in result:
-            table_name = row['table_name']
-            if table_name in self.__db_tables__:
-                self.__db_tables__[table_name].add_column(Column.from_db_row(**row))
-        
 
-    def _ensure_table(self, cls):
-        if cls.__table__.name not in self.__db_tables__:
-            if self._sambar_dip:
-                table_name = cls.__table__.name
-                self.exec_sql(sql_factory.create_table(table_name))
-                self.__db_tables__[table_name] = Table(table_name)
-            else:
-                raise TableNotFoundError(f'Table {cls.__tablename__} for model {cls.__name__} does not exist on database')
+class BaseConnection:
+    # Reading a model's declaration and binding its methods doesn't touch the
+    # database, so it is shared by Connection and ShardedConnection.
+
+    def _declare_model(self, cls):
+        s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', cls.__name__)
+        s2 = re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1)
+        cls.__table__ = Table(s2.lower())
+
+        self._build_column_model(cls)
+        self._handle_directives(cls)
 
 
     def _build_column_model(self, cls):
@@ -66,7 +57,7 @@ class Connection:
                 continue
                 
             col_name = key
-            type_args = get_args(val)
+            type_args = get_args(val) if get_origin(val) is not list else ()
             if type_args:
                 if len(type_args)==1:
                     col_class = type_args[0]
@@ -92,45 +83,340 @@ class Connection:
             ))
 
 
-    def _reconcile_columns(self, cls):
+    def _handle_directives(self, cls):
+        directives = getattr(cls, '__idli__', [])
+        cls.__primary_key__ = ['id']
+        cls.__partition__ = None
+        cls.__shard_key__ = None
+
+        for d in directives:
+            if type(d) is PrimaryKey:
+                cls.__primary_key__ = d.columns
+            elif type(d) is Partition:
+                cls.__partition__ = d
+            elif type(d) is ShardKey:
+                cls.__shard_key__ = d
+
+        partition = cls.__partition__
+        if partition is not None:
+            column = cls.__table__.columns.get(partition.by)
+            if column is None or column.column_type not in ('DATE', 'TIMESTAMP'):
+                raise InvalidPartitionError(f"Partition column '{partition.by}' must be a date or datetime column")
+            if partition.by not in cls.__primary_key__:
+                raise InvalidPartitionError(f"Primary key of partitioned table '{cls.__table__.name}' must include '{partition.by}'")
+
+
+    def _bind_model(self, cls):
+        cls._connection = self
+        cls.__init__ = model_methods.__init__
+        cls.save = model_methods.save
+        cls._save_existing = model_methods._save_existing
+        cls._save_new = model_methods._save_new
+
+        cls.select = classmethod(model_methods.select)
+        cls.get = classmethod(model_methods.get)
+        cls.get_many = classmethod(model_methods.get_many)
+        cls._obj_from_dict = classmethod(model_methods._obj_from_dict)
+
+
+
+class Connection(BaseConnection):
+
+    def __init__(
+        self,
+        db_uri: str,
+        sambar_dip: bool = False,
+        dry_run: bool = False,
+        lock_timeout: int = 2000,
+        migration_retries: int = 5,
+        migration_backoff: float = 0.5,
+        backfill_batch_pages: int = 100,
+        pool_size: int = 4,
+        max_connections: int | None = None,
+        processes: int | None = None,
+    ):
+        self._db_uri = db_uri
+        self._pool_size = pool_size
+        self._max_connections = max_connections
+        self._processes = processes
+
+        # The pool is built lazily for each process. One inherited across a fork
+        # shares its sockets with the parent, so it is set aside (never closed
+        # or garbage collected in the child) and a fresh one is opened.
+        self._pool = None
+        self._pool_pid = None
+        self._inherited_pools = []
+        self._pool_lock = threading.Lock()
+        self._models = []
+        _connections.add(self)
+        
+        # dry_run plans what sambar_dip would do and prints it, without executing anything
+        self._sambar_dip = sambar_dip or dry_run
+        self._dry_run = dry_run
+        self._lock_timeout = lock_timeout
+        self._migration_retries = migration_retries
+        self._migration_backoff = migration_backoff
+        self._backfill_batch_pages = backfill_batch_pages
+
+        self.load_tables()
+        self.load_columns()
+        
+
+    def _after_fork(self):
+        self._pool_lock = threading.Lock()
+
+
+    def _pool_max_size(self):
+        if self._max_connections is None:
+            return self._pool_size
+
+        processes = self._processes or int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+        budget = self._max_connections // processes
+        if budget < 1:
+            raise ConnectionBudgetError(f"max_connections={self._max_connections} is too low for {processes} processes")
+        return min(self._pool_size, budget)
+
+
+    def _get_pool(self):
+        pid = os.getpid()
+        if self._pool is not None and self._pool_pid == pid:
+            return self._pool
+
+        with self._pool_lock:
+            if self._pool is not None and self._pool_pid != pid:
+                self._inherited_pools.append(self._pool)
+                self._pool = None
+
+            if self._pool is None:
+                max_size = self._pool_max_size()
+                self._pool = ConnectionPool(
+                    self._db_uri,
+                    min_size = min(4, max_size),
+                    max_size = max_size,
+                    open = True,
+                )
+                self._pool_pid = pid
+            return self._pool
+
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                if self._pool_pid == os.getpid():
+                    self._pool.close()
+                else:
+                    self._inherited_pools.append(self._pool)
+            self._pool = None
+
+
+    def exec_sql(self, *args, binary: bool = False):
+        with self._get_pool().connection() as conn:
+            return conn.execute(*args, binary=binary)
+            
+    
+    def exec_sql_to_dict_rows(self, *args, binary: bool = False):
+        with self._get_pool().connection() as conn:
+            cur = conn.cursor(row_factory = dict_row)
+            return cur.execute(*args, binary=binary)
+
+
+    def _shard_for_values(self, cls, values: dict):
+        return self
+
+
+    def _query_rows(self, cls, filters, limit, skip, order_by, c_collated=None):
+        return self.exec_sql_to_dict_rows(
+            *sql_factory.query_rows(
+                table_name = cls.__table__.name,
+                filters = filters,
+                limit = limit,
+                skip = skip,
+                order_by = order_by,
+                c_collated = c_collated,
+            ),
+            binary = True,
+        )
+
+
+    def _query_rows_by_keys(self, cls, columns, keys):
+        return self.exec_sql_to_dict_rows(
+            *sql_factory.query_rows_by_keys(
+                table_name = cls.__table__.name,
+                columns = columns,
+                keys = keys,
+            ),
+            binary = True,
+        )
+
+
+    def load_tables(self):
+        result = self.exec_sql_to_dict_rows(sql_factory.list_tables()).fetchall()
+        self.__db_tables__ = { row['table_name']: Table(row['table_name']) for row in result }
+
+
+    def load_columns(self):
+        result = self.exec_sql_to_dict_rows(sql_factory.list_columns()).fetchall()
+        for row in result:
+            table_name = row['table_name']
+            if table_name in self.__db_tables__:
+                self.__db_tables__[table_name].add_column(Column.from_db_row(**row))
+        
+
+    def _apply_plan(self, plan: MigrationPlan):
+        if self._dry_run:
+            print(plan.describe())
+            return
+
+        plan.apply(
+            self._get_pool(),
+            lock_timeout = self._lock_timeout,
+            retries = self._migration_retries,
+            backoff = self._migration_backoff,
+        )
+
+
+    def _ensure_table(self, cls, plan: MigrationPlan):
+        table_name = cls.__table__.name
+        partition = cls.__partition__
+
+        if table_name not in self.__db_tables__:
+            if self._sambar_dip:
+                self.__db_tables__[table_name] = Table(table_name)
+                if partition is None:
+                    plan.add(
+                        f'create table {table_name}',
+                        [sql_factory.create_table(table_name)],
+                    )
+                else:
+                    # A partitioned table needs its partition key column at creation
+                    column = cls.__table__.columns[partition.by]
+                    plan.add(
+                        f'create table {table_name} partitioned by range ({partition.by})',
+                        [sql_factory.create_partitioned_table(table_name, column)],
+                    )
+                    self.__db_tables__[table_name].add_column(Column(
+                        table_name = table_name,
+                        name = column.name,
+                        column_type = column.column_type,
+                        nullable = column.nullable,
+                    ))
+                plan.creates_table = True
+            else:
+                raise TableNotFoundError(f'Table {table_name} for model {cls.__name__} does not exist on database')
+
+        elif partition is not None:
+            result = self.exec_sql(sql_factory.is_partitioned_table(table_name)).fetchall()
+            if len(result) == 0:
+                raise TableNotPartitionedError(f"Table '{table_name}' exists on database but is not partitioned")
+
+
+    def _reconcile_columns(self, cls, plan: MigrationPlan):
         for column in cls.__table__.columns.values():
             db_table = self.__db_tables__[cls.__table__.name]
             db_column = db_table.columns.get(column.name)
             
             if db_column:
-                if db_column.column_type != column.column_type:
+                if not column.stored_as(db_column.udt_name):
                     raise ColumnTypeMismatchError(f"Column '{column.name}' is type '{db_column.column_type}' on database")
                 
                 if db_column.nullable == False and column.nullable == True:
                     if self._sambar_dip:
-                        self.exec_sql(sql_factory.make_column_nullable(column))
+                        plan.add(
+                            f"make column '{column.name}' nullable",
+                            [sql_factory.make_column_nullable(column)],
+                        )
                     else:
                         raise ColumnNotNullableError(f"Changing column '{column.name}' to nullable is not supported with sambar_dip=False")
                 if db_column.nullable == True and column.nullable == False:
+                    if self._sambar_dip and column.needs_backfill():
+                        # Resume an auto column whose backfill was interrupted
+                        self._plan_auto_column(column, plan, add=False)
+                        continue
                     raise ColumnNullableError(f"Changing column '{column.name}' to not nullable is not supported")
 
-                if db_column.default != column.default:
+                db_default = db_column.default
+                if server_default(column.default) is not None or server_default(db_default) is not None:
+                    # e.g. uuid.uuid7 on the model and AutoUUID read back are both uuidv7()
+                    default_matches = server_default(column.default) == server_default(db_default)
+                else:
+                    if db_column.column_type != column.column_type and db_default not in (None, AutoInt):
+                        # A compatible column type parses its default its own way, e.g.
+                        # NUMERIC as a Decimal, so read it as the model's type instead
+                        try:
+                            db_default = COLUMN_TYPES[column.column_type].db_to_py(str(db_default))
+                        except (TypeError, ValueError):
+                            pass
+                    default_matches = db_default in (column.default, column.py_to_db(column.default))
+
+                if not default_matches:
                     if self._sambar_dip:
-                        self.exec_sql(sql_factory.set_default_column_value(column))
+                        plan.add(
+                            f"set default of column '{column.name}'",
+                            [sql_factory.set_default_column_value(column)],
+                        )
                     else:
                         raise ColumnDefaultMismatchError(f"Defined default value for column '{column.name}' does not match with the database")
             else:
                 if self._sambar_dip:
-                    self.exec_sql(sql_factory.create_column(column))
+                    if column.needs_backfill() and not plan.creates_table:
+                        self._plan_auto_column(column, plan, add=True)
+                    else:
+                        plan.add(f"add column '{column.name}'", [sql_factory.create_column(column)])
                 else:
                     raise ColumnNotFoundError(f"Column '{column.name}' does not exist in table '{cls.__table__.name}'")
 
 
-    def _handle_directives(self, cls):
-        directives = getattr(cls, '__idli__', [])
-        cls.__primary_key__ = ['id']
+    def _plan_auto_column(self, column: Column, plan: MigrationPlan, add: bool):
+        # Adding a SERIAL or uuidv7() column in one go rewrites the whole table
+        # under ACCESS EXCLUSIVE. Instead add it as nullable, fill it in small
+        # batches, and only then enforce NOT NULL through a validated CHECK.
+        statements = []
+        if add:
+            statements.append(sql_factory.add_nullable_column(column))
+        if column.default == AutoInt:
+            statements.append(sql_factory.create_column_sequence(column))
+        statements.append(sql_factory.set_default_column_value(column))
+        plan.add(
+            f"add column '{column.name}' as nullable with its default" if add else f"set default of column '{column.name}'",
+            statements,
+        )
 
-        for d in directives:
-            if type(d) is PrimaryKey:
-                cls.__primary_key__ = d.columns
+        plan.add(
+            f"backfill column '{column.name}' in batches of {self._backfill_batch_pages} pages",
+            [_backfill_statement(column, self._backfill_batch_pages)],
+            lock = 'ROW EXCLUSIVE',
+            batched = True,
+        )
+
+        if column.nullable:
+            return
 
+        check_name = sql_factory.not_null_check_name(column)
+        plan.add(
+            f"add NOT VALID check {check_name}",
+            [
+                sql_factory.drop_constraint(column.table_name, check_name, if_exists=True),
+                sql_factory.add_not_null_check(column),
+            ],
+            isolated = True,
+        )
+        plan.add(
+            f"validate check {check_name}",
+            [sql_factory.validate_constraint(column.table_name, check_name)],
+            lock = 'SHARE UPDATE EXCLUSIVE',
+            isolated = True,
+        )
+        plan.add(
+            f"set column '{column.name}' NOT NULL using check {check_name}",
+            [
+                sql_factory.set_column_not_null(column),
+                sql_factory.drop_constraint(column.table_name, check_name),
+            ],
+            isolated = True,
+        )
 
-    def _reconcile_primary_key(self, cls):
+
+    def _reconcile_primary_key(self, cls, plan: MigrationPlan):
         defined_pk_columns = cls.__primary_key__
 
         constraint = self.exec_sql_to_dict_rows(
@@ -138,10 +424,7 @@ class Connection:
         ).fetchall()
 
         if len(constraint) == 0:
-            self.exec_sql(sql_factory.create_primary_key(
-                table_name = cls.__table__.name,
-                columns = defined_pk_columns,
-            ))
+            self._plan_primary_key(cls, plan)
             return
 
         constraint_name = constraint[0]['constraint_name']
@@ -161,35 +444,192 @@ class Connection:
                     break
                     
         if reconciliation_required:    
-            self.exec_sql(sql_factory.drop_constraint(
-                table_name = cls.__table__.name,
-                constraint_name = constraint_name,
-            ))
+            self._plan_primary_key(cls, plan, constraint_name)
 
-            self.exec_sql(sql_factory.create_primary_key(
-                table_name = cls.__table__.name,
-                columns = defined_pk_columns,
+
+    def _plan_primary_key(self, cls, plan: MigrationPlan, old_constraint_name: str | None = None):
+        table_name = cls.__table__.name
+        columns = cls.__primary_key__
+
+        # Partitioned tables can't build indexes concurrently or attach a
+        # constraint using an index, so they take the plain route.
+        if plan.creates_table or cls.__partition__ is not None:
+            statements = []
+            if old_constraint_name is not None:
+                statements.append(sql_factory.drop_constraint(
+                    table_name = table_name,
+                    constraint_name = old_constraint_name,
+                ))
+            statements.append(sql_factory.create_primary_key(table_name = table_name, columns = columns))
+            plan.add(f"add primary key ({', '.join(columns)})", statements)
+            return
+
+        # Build the replacement index without blocking writes, then swap it in
+        # with a short ACCESS EXCLUSIVE lock instead of a full ADD PRIMARY KEY.
+        index_name = table_name + '_pkey_new'
+        plan.add(
+            f"build unique index {index_name} ({', '.join(columns)}) concurrently",
+            [
+                sql_factory.drop_index_concurrently(index_name),
+                sql_factory.create_unique_index_concurrently(
+                    table_name = table_name,
+                    index_name = index_name,
+                    columns = columns,
+                ),
+            ],
+            lock = 'SHARE UPDATE EXCLUSIVE',
+            concurrent = True,
+        )
+
+        statements = []
+        if old_constraint_name is not None:
+            statements.append(sql_factory.drop_constraint(
+                table_name = table_name,
+                constraint_name = old_constraint_name,
             ))
+        statements.append(sql_factory.add_primary_key_using_index(
+            table_name = table_name,
+            index_name = index_name,
+        ))
+        plan.add(f'swap in primary key using index {index_name}', statements)
     
     
-    def Model(self, cls):
-        s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', cls.__name__)
-        s2 = re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1)
-        cls.__table__ = Table(s2.lower())
+    def _reconcile_partitions(self, cls, plan: MigrationPlan, today: date | None = None):
+        partition = cls.__partition__
+        if partition is None:
+            return
 
-        self._ensure_table(cls)
-        self._build_column_model(cls)
-        self._reconcile_columns(cls)
-        self._handle_directives(cls)
-        self._reconcile_primary_key(cls)
+        table_name = cls.__table__.name
+        existing = {}
+        pending = {}
+        orphaned = {}
+        if not plan.creates_table:
+            result = self.exec_sql_to_dict_rows(sql_factory.list_partitions(table_name)).fetchall()
+            for row in result:
+                start = partition.partition_start(table_name, row['partition_name'])
+                if start is None:
+                    continue
+                if row['detach_pending']:
+                    pending[start] = row
+                elif row['attached']:
+                    existing[start] = row['partition_name']
+                elif row['detached_by_idli']:
+                    orphaned[start] = row['partition_name']
+                # Tables detached by hand, e.g. to archive them, are left alone
 
-        cls._connection = self
-        cls.__init__ = model_methods.__init__
-        cls.save = model_methods.save
-        cls._save_existing = model_methods._save_existing
-        cls._save_new = model_methods._save_new
+        current = partition.period_start(today or date.today())
+        oldest_retained = partition.shift(current, -partition.retain) if partition.retain is not None else None
 
-        cls.select = classmethod(model_methods.select)
-        cls._obj_from_dict = classmethod(model_methods._obj_from_dict)
-        
+        def expired(start):
+            return oldest_retained is not None and start < oldest_retained
+
+        # A concurrent detach interrupted in its second phase leaves the partition
+        # "detach pending"; it can only be finished with DETACH ... FINALIZE. Only
+        # one idli started on an expired partition is dropped afterwards.
+        for start, row in sorted(pending.items()):
+            drop = partition.drop and row['detached_by_idli'] and expired(start)
+            self._plan_detach_partition(table_name, row['partition_name'], drop, plan, mark=False)
+
+        for i in range(partition.premake + 1):
+            start = partition.shift(current, i)
+            if start in existing:
+                continue
+            partition_name = partition.partition_name(table_name, start)
+            plan.add(
+                f'create partition {partition_name}',
+                [sql_factory.create_partition(
+                    table_name = table_name,
+                    partition_name = partition_name,
+                    start = start,
+                    end = partition.shift(start, 1),
+                )],
+            )
+
+        for start, partition_name in sorted(existing.items()):
+            if expired(start):
+                self._plan_detach_partition(table_name, partition_name, partition.drop, plan)
+
+        # Expired partitions idli detached but never dropped, e.g. because the
+        # drop ran out of lock retries on an earlier run
+        if partition.drop:
+            for start, partition_name in sorted(orphaned.items()):
+                if expired(start):
+                    plan.add(
+                        f'drop detached table {partition_name}',
+                        [sql_factory.drop_table(partition_name)],
+                    )
+
+
+    def _plan_detach_partition(self, table_name: str, partition_name: str, drop: bool, plan: MigrationPlan, mark: bool = True):
+        # The comment, set before detaching, tells a table idli detached apart from
+        # one detached by hand if the drop doesn't happen on this run
+        statements = []
+        if mark:
+            statements.append(sql_factory.comment_detached_partition(table_name, partition_name))
+        statements.append(_detach_partition_statement(table_name, partition_name))
+        plan.add(
+            f'detach partition {partition_name}',
+            statements,
+            lock = 'SHARE UPDATE EXCLUSIVE',
+            concurrent = True,
+        )
+        if drop:
+            plan.add(
+                f'drop table {partition_name}',
+                [sql_factory.drop_table(partition_name)],
+            )
+
+
+    def manage_partitions(self, today: date | None = None):
+        for cls in self._models:
+            if cls.__partition__ is not None:
+                plan = MigrationPlan(cls.__table__.name)
+                self._reconcile_partitions(cls, plan, today)
+                self._apply_plan(plan)
+
+
+    def _reconcile_model(self, cls):
+        plan = MigrationPlan(cls.__table__.name)
+        self._ensure_table(cls, plan)
+        self._reconcile_columns(cls, plan)
+        self._reconcile_primary_key(cls, plan)
+        if self._sambar_dip:
+            self._reconcile_partitions(cls, plan)
+        self._apply_plan(plan)
+        self._models.append(cls)
+
+
+    def Model(self, cls):
+        self._declare_model(cls)
+        self._reconcile_model(cls)
+        self._bind_model(cls)
         return cls
+
+
+
+def _backfill_statement(column: Column, pages: int):
+    # Walks the table a range of pages at a time, so no round rescans the rows
+    # earlier rounds filled. A concurrent update can move a row that is still
+    # NULL behind the walk, so one last round sweeps up whatever is left.
+    end_page = []
+    def statement(conn, n):
+        if not end_page:
+            end_page.append(conn.execute(sql_factory.get_relation_pages(column.table_name)).fetchone()[0])
+        rounds = -(-end_page[0] // pages)
+        if n < rounds:
+            return sql_factory.backfill_column_default(column, n * pages, (n + 1) * pages)
+        if n == rounds:
+            return sql_factory.backfill_column_default(column)
+        return None
+    return statement
+
+
+def _detach_partition_statement(table_name: str, partition_name: str):
+    # Decided when the step runs, so a retry after a lock timeout in the second
+    # phase of DETACH ... CONCURRENTLY finalizes instead of failing
+    def statement(conn):
+        row = conn.execute(sql_factory.get_detach_pending(table_name, partition_name)).fetchone()
+        if row is None:
+            return None
+        return sql_factory.detach_partition_concurrently(table_name, partition_name, finalize=row[0])
+    return statement
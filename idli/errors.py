@@ -16,12 +16,36 @@ class ColumnNullableError(Exception):
 class ColumnTypeMismatchError(Exception):
     pass
 
+class ConnectionBudgetError(Exception):
+    pass
+
 class InvalidColumnTypeError(Exception):
     pass
 
+class InvalidDefaultError(Exception):
+    pass
+
+class InvalidFilterError(Exception):
+    pass
+
+class InvalidPartitionError(Exception):
+    pass
+
+class InvalidShardKeyError(Exception):
+    pass
+
 class InvalidValueTypeError(Exception):
     pass
 
+class MigrationLockTimeoutError(Exception):
+    pass
+
+class ShardRoutingError(Exception):
+    pass
+
 class TableNotFoundError(Exception):
     pass
 
+class TableNotPartitionedError(Exception):
+    pass
+
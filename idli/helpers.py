@@ -1,3 +1,9 @@
+import bisect
+from datetime import date, datetime, timedelta
+import hashlib
+from typing import List
+
+from idli.errors import InvalidPartitionError, InvalidShardKeyError
 
 
 class AutoInt:
@@ -8,7 +14,86 @@ class AutoUUID:
     pass
 
 
+class Partition:
+
+    INTERVALS = ('day', 'week', 'month', 'year')
+
+    def __init__(
+        self,
+        by: str,
+        interval: str = 'month',
+        retain: int | None = None,
+        premake: int = 3,
+        drop: bool = True,
+    ):
+        if interval not in self.INTERVALS:
+            raise InvalidPartitionError(f"Unsupported partition interval '{interval}'")
+
+        self.by = by
+        self.interval = interval
+        self.retain = retain
+        self.premake = premake
+        self.drop = drop
+
+
+    def period_start(self, dt):
+        d = dt.date() if isinstance(dt, datetime) else dt
+        if self.interval == 'week':
+            return d - timedelta(days=d.weekday())
+        if self.interval == 'month':
+            return d.replace(day=1)
+        if self.interval == 'year':
+            return d.replace(month=1, day=1)
+        return d
+
+
+    def shift(self, start: date, n: int):
+        if self.interval == 'day':
+            return start + timedelta(days=n)
+        if self.interval == 'week':
+            return start + timedelta(weeks=n)
+        if self.interval == 'month':
+            m = start.month - 1 + n
+            return date(start.year + m // 12, m % 12 + 1, 1)
+        return date(start.year + n, 1, 1)
+
+
+    def partition_name(self, table_name: str, start: date):
+        return f'{table_name}_p{start:%Y%m%d}'
+
+
+    def partition_start(self, table_name: str, partition_name: str):
+        suffix = partition_name.removeprefix(table_name + '_p')
+        if suffix == partition_name or len(suffix) != 8 or not suffix.isdigit():
+            return None
+        return datetime.strptime(suffix, '%Y%m%d').date()
+
+
 class PrimaryKey:
 
     def __init__(self, *args):
         self.columns = list(args)
+
+
+class ShardKey:
+
+    METHODS = ('hash', 'range')
+
+    def __init__(self, column: str, method: str = 'hash', ranges: List | None = None):
+        if method not in self.METHODS:
+            raise InvalidShardKeyError(f"Unsupported sharding method '{method}'")
+        if method == 'range' and not ranges:
+            raise InvalidShardKeyError("Range sharding needs the upper bounds of all but the last shard in 'ranges'")
+
+        self.column = column
+        self.method = method
+        self.ranges = sorted(ranges) if ranges else None
+
+
+    def shard_for(self, value, num_shards: int):
+        if self.method == 'range':
+            return bisect.bisect_right(self.ranges, value)
+
+        # Python's hash() is salted per process, so use a stable digest instead
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') % num_shards
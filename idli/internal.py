@@ -1,10 +1,16 @@
 import copy
-from datetime import datetime
-from typing import List
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+import json
+from typing import List, get_args, get_origin
+import uuid
 from uuid import UUID
 
+from psycopg.types.json import Jsonb
+
 from idli import sql_factory
-from idli.errors import InvalidColumnTypeError
+from idli.errors import InvalidColumnTypeError, InvalidDefaultError
 from idli.helpers import *
 
 
@@ -13,61 +19,196 @@ DATE_FMT = "%Y-%m-%d %H:%M:%S.%f"
 
 class ColumnType:
 
-    def __init__(self, py_type, db_type, py_to_db, db_to_py, db_val_to_py_val):
+    def __init__(
+        self,
+        py_type,
+        udt_name,
+        sql_type,
+        py_to_db,
+        db_to_py,
+        db_val_to_py_val,
+        element_type = None,
+        compatible_udt_names = (),
+    ):
         self.py_type = py_type
-        self.db_type = db_type
+        self.udt_name = udt_name
+        self.sql_type = sql_type
         self.py_to_db = py_to_db
         self.db_to_py = db_to_py
         self.db_val_to_py_val = db_val_to_py_val
-
-    
-COLUMN_TYPES = {
-    'BOOLEAN': ColumnType(
-        py_type = bool,
-        db_type = 'boolean',
-        py_to_db = lambda x: str(x) if x is not None else None,
-        db_to_py = lambda x: x.lower()=='true',
-        db_val_to_py_val = lambda x: x,
-    ),
-    'TIMESTAMP': ColumnType(
-        py_type = datetime,
-        db_type = 'timestamp without time zone',
-        py_to_db = lambda x: x.strftime(DATE_FMT) if x is not None else None,
-        db_to_py = lambda x: datetime.strptime(x, DATE_FMT),
-        db_val_to_py_val = lambda x: x,
-    ),
-    'NUMERIC': ColumnType(
-        py_type = float,
-        db_type = 'numeric',
-        py_to_db = lambda x: str(x) if x is not None else None,
-        db_to_py = lambda x: float(x),
-        db_val_to_py_val = lambda x: float(x) if x is not None else None,
-    ),
-    'INTEGER': ColumnType(
-        py_type = int,
-        db_type = 'integer',
-        py_to_db = lambda x: str(x) if x is not None else None,
-        db_to_py = lambda x: int(x),
-        db_val_to_py_val = lambda x: x,
-    ),
-    'VARCHAR': ColumnType(
-        py_type = str,
-        db_type = 'character varying',
-        py_to_db = lambda x: x if x is not None else None,
-        db_to_py = lambda x: x,
-        db_val_to_py_val = lambda x: x,
-    ),
-    'UUID': ColumnType(
-        py_type = UUID,
-        db_type = 'uuid',
-        py_to_db = lambda x: str(x) if x is not None else None,
-        db_to_py = lambda x: UUID(x),
-        db_val_to_py_val = lambda x: x,
-    ),
+        self.element_type = element_type
+        self.compatible_udt_names = compatible_udt_names
+
+
+COLUMN_TYPES = {}
+PY_COLUMN_TYPES = {}
+DB_COLUMN_TYPES = {}
+ARRAY_COLUMN_TYPES = {}
+
+
+def _identity(x):
+    return x
+
+
+def register_type(
+    name: str,
+    py_type,
+    udt_name: str,
+    sql_type: str | None = None,
+    py_to_db = _identity,
+    db_to_py = _identity,
+    db_val_to_py_val = _identity,
+    array: bool = False,
+    compatible_udt_names = (),
+):
+    """
+    Register a column type. Values are handed to psycopg as native Python objects
+    (after py_to_db) and come back as whatever psycopg loads for udt_name (passed
+    through db_val_to_py_val). db_to_py parses a column default read from the
+    database. With array=True, a list[py_type] column type is registered as well.
+    """
+    COLUMN_TYPES[name] = ColumnType(
+        py_type = py_type,
+        udt_name = udt_name,
+        sql_type = sql_type or name,
+        py_to_db = py_to_db,
+        db_to_py = db_to_py,
+        db_val_to_py_val = db_val_to_py_val,
+        compatible_udt_names = compatible_udt_names,
+    )
+    PY_COLUMN_TYPES[py_type] = name
+    DB_COLUMN_TYPES.setdefault(udt_name, name)
+
+    if array:
+        array_name = name + '[]'
+        COLUMN_TYPES[array_name] = ColumnType(
+            py_type = list,
+            udt_name = '_' + udt_name,
+            sql_type = (sql_type or name) + '[]',
+            py_to_db = _identity,
+            db_to_py = lambda x: [db_to_py(v) for v in _split_array_literal(x)],
+            db_val_to_py_val = lambda x: [db_val_to_py_val(v) for v in x] if x is not None else None,
+            element_type = name,
+            compatible_udt_names = tuple('_' + u for u in compatible_udt_names),
+        )
+        ARRAY_COLUMN_TYPES[py_type] = array_name
+        DB_COLUMN_TYPES.setdefault('_' + udt_name, array_name)
+
+
+def column_type_for(column_class):
+    if get_origin(column_class) is list:
+        type_args = get_args(column_class)
+        return ARRAY_COLUMN_TYPES.get(type_args[0]) if type_args else None
+
+    # Enums often mix in str or int, which would otherwise match first
+    if isinstance(column_class, type) and issubclass(column_class, Enum):
+        return PY_COLUMN_TYPES[Enum]
+
+    for cls in getattr(column_class, '__mro__', [column_class]):
+        if cls in PY_COLUMN_TYPES:
+            return PY_COLUMN_TYPES[cls]
+    return None
+
+
+def _split_array_literal(x):
+    x = x.strip('{}')
+    return [v.strip('"') for v in x.split(',')] if x else []
+
+
+register_type(
+    'BOOLEAN', bool, 'bool',
+    db_to_py = lambda x: x.lower()=='true',
+    array = True,
+)
+register_type(
+    'TIMESTAMP', datetime, 'timestamp',
+    db_to_py = lambda x: datetime.strptime(x, DATE_FMT),
+    array = True,
+)
+register_type(
+    'DATE', date, 'date',
+    db_to_py = date.fromisoformat,
+    array = True,
+)
+# float columns used to be created as NUMERIC; those keep working, with
+# values converted back to float on load.
+register_type(
+    'DOUBLE PRECISION', float, 'float8',
+    db_to_py = float,
+    db_val_to_py_val = lambda x: float(x) if x is not None else None,
+    array = True,
+    compatible_udt_names = ('numeric',),
+)
+register_type(
+    'NUMERIC', Decimal, 'numeric',
+    db_to_py = Decimal,
+    array = True,
+)
+register_type(
+    'INTEGER', int, 'int4',
+    db_to_py = int,
+    array = True,
+)
+register_type(
+    'VARCHAR', str, 'varchar',
+    array = True,
+)
+register_type(
+    'UUID', UUID, 'uuid',
+    db_to_py = UUID,
+    array = True,
+)
+register_type(
+    'BYTEA', bytes, 'bytea',
+    db_to_py = lambda x: bytes.fromhex(x[2:]),
+    db_val_to_py_val = lambda x: bytes(x) if x is not None else None,
+)
+register_type(
+    'JSONB', dict, 'jsonb',
+    py_to_db = Jsonb,
+    db_to_py = json.loads,
+)
+# Enums are stored by value in a VARCHAR column and turned back into members
+# of the model's enum class when loaded.
+register_type(
+    'ENUM', Enum, 'varchar',
+    sql_type = 'VARCHAR',
+    py_to_db = lambda x: str(x.value) if isinstance(x, Enum) else x,
+)
+
+
+# Function defaults are left for the database to fill in, with the server-side
+# default standing in for each. Defaults read back from the database map back.
+SERVER_DEFAULTS = {
+    AutoUUID: 'uuidv7()',
+    datetime.now: 'now()',
+    date.today: 'CURRENT_DATE',
+    uuid.uuid4: 'gen_random_uuid()',
 }
+if hasattr(uuid, 'uuid7'):
+    SERVER_DEFAULTS[uuid.uuid7] = 'uuidv7()'
+# Volatile defaults give every existing row its own value, so adding a column
+# with one rewrites the table
+VOLATILE_SERVER_DEFAULTS = ('uuidv7()', 'gen_random_uuid()')
+SERVER_DEFAULT_VALUES = {
+    'now()': datetime.now,
+    'CURRENT_DATE': date.today,
+    'gen_random_uuid()': uuid.uuid4,
+}
+
+
+def server_default(default):
+    try:
+        return SERVER_DEFAULTS.get(default)
+    except TypeError:
+        return None
+
 
-PY_COLUMN_TYPES = { COLUMN_TYPES[key].py_type: key for key in COLUMN_TYPES }
-DB_COLUMN_TYPES = { COLUMN_TYPES[key].db_type: key for key in COLUMN_TYPES }
+def _enum_member(enum_class, val):
+    for member in enum_class:
+        if str(member.value) == val:
+            return member
+    return enum_class(val)
 
 
 
@@ -80,12 +221,14 @@ class Column:
         column_type = None,
         nullable: bool = False,
         default = None,
+        py_class = None,
     ):
         self.table_name = table_name
         self.name = name
         self.column_type = column_type
         self.nullable = nullable
         self.default = default
+        self.py_class = py_class
 
 
     @staticmethod
@@ -97,15 +240,23 @@ class Column:
         default = None,
     ):
         
-        if column_class not in PY_COLUMN_TYPES:
-            raise InvalidColumnTypeError(f"Unsupported class '{column_class.__name__}' for column '{name}'")
+        column_type = column_type_for(column_class)
+        if column_type is None:
+            raise InvalidColumnTypeError(f"Unsupported class '{column_class}' for column '{name}'")
+
+        if callable(default) and default is not AutoInt and server_default(default) is None:
+            raise InvalidDefaultError(
+                f"Unsupported default '{default}' for column '{name}', function defaults must be one of: "
+                + ', '.join(getattr(f, '__qualname__', str(f)) for f in SERVER_DEFAULTS if f is not AutoUUID)
+            )
         
         return Column(
             table_name = table_name,
             name = name,
-            column_type = PY_COLUMN_TYPES[column_class],
+            column_type = column_type,
             nullable = nullable,
             default = default,
+            py_class = get_origin(column_class) or column_class,
         )
 
 
@@ -114,16 +265,19 @@ class Column:
         table_name: str,
         column_name: str,
         data_type: str,
+        udt_name: str,
         is_nullable: str,
         column_default,
     ):
-        if data_type not in DB_COLUMN_TYPES:
-            raise InvalidColumnTypeError(f"Unsupported class '{column_class.__name__}' for column '{name}'")
+        if udt_name not in DB_COLUMN_TYPES:
+            raise InvalidColumnTypeError(f"Unsupported type '{data_type}' for column '{column_name}'")
 
-        column_type = DB_COLUMN_TYPES[data_type]
+        column_type = DB_COLUMN_TYPES[udt_name]
 
         if column_default:
-            if column_type=='BOOLEAN':
+            if column_default in SERVER_DEFAULT_VALUES:
+                column_default = SERVER_DEFAULT_VALUES[column_default]
+            elif column_type=='BOOLEAN':
                 column_default = True if column_default.lower()=='true' else False
             elif column_type=='INTEGER':
                 default_for_auto = f"nextval('{table_name}_{column_name}_seq'::regclass)"
@@ -134,11 +288,6 @@ class Column:
                         column_default = int(column_default)
                     except:
                         pass
-            elif column_type=='NUMERIC':
-                try:
-                    column_default = float(column_default)
-                except:
-                    pass
             elif column_type=="TIMESTAMP":
                 try:
                     column_default = column_default.rsplit('::timestamp without time zone', 1)[0].strip("'")
@@ -158,6 +307,13 @@ class Column:
                         pass            
             elif column_type=='VARCHAR':
                 column_default = column_default.rsplit('::character varying', 1)[0].strip("'")
+            else:
+                try:
+                    column_default = COLUMN_TYPES[column_type].db_to_py(
+                        column_default.rsplit('::', 1)[0].strip("'")
+                    )
+                except Exception:
+                    pass
 
         
         return Column(
@@ -173,12 +329,41 @@ class Column:
         return f'Column<{self.column_type}> {self.name}'
 
 
+    @property
+    def udt_name(self):
+        return COLUMN_TYPES[self.column_type].udt_name
+
+
+    def needs_backfill(self):
+        return self.default is AutoInt or server_default(self.default) in VOLATILE_SERVER_DEFAULTS
+
+
+    def stored_as(self, udt_name: str):
+        column_type = COLUMN_TYPES[self.column_type]
+        return udt_name == column_type.udt_name or udt_name in column_type.compatible_udt_names
+
+
+    def accepts(self, val):
+        py_class = self.py_class or COLUMN_TYPES[self.column_type].py_type
+        if type(val) is bool and py_class is not bool:
+            return False
+        # datetime subclasses date, but Postgres would silently drop its time
+        if isinstance(val, datetime) and py_class is date:
+            return False
+        return isinstance(val, py_class)
+
+
     def py_to_db(self, val):
+        if val is None:
+            return None
         return COLUMN_TYPES[self.column_type].py_to_db(val)
 
 
     def db_val_to_py_val(self, db_val):
-        return COLUMN_TYPES[self.column_type].db_val_to_py_val(db_val)
+        val = COLUMN_TYPES[self.column_type].db_val_to_py_val(db_val)
+        if self.column_type == 'ENUM' and self.py_class is not None and val is not None:
+            val = _enum_member(self.py_class, val)
+        return val
 
 
 
@@ -201,19 +386,34 @@ class QuerySet:
 
 
     def __iter__(self):
-        self._cursor = self._cls._connection.exec_sql_to_dict_rows(
-            sql_factory.query_rows(
-                table_name = self._cls.__table__.name,
-                filters = self._filters,
-                limit = self._limit,
-                skip = self._skip,
-                order_by = self._order_by,
-            )
+        self._cursor = self._cls._connection._query_rows(
+            self._cls,
+            filters = self._db_filters(),
+            limit = self._limit,
+            skip = self._skip,
+            order_by = self._order_by,
         )
         for row in self._cursor:
             yield self._cls._obj_from_dict(row)
     
 
+    def _db_filters(self):
+        if self._filters is None:
+            return None
+
+        db_filters = {}
+        for key, val in self._filters.items():
+            col, op = sql_factory.split_filter_key(key)
+            column = self._cls.__table__.columns.get(col)
+            if column is None or op in ('isnull', 'like', 'ilike'):
+                db_filters[key] = val
+            elif op in ('in', 'between'):
+                db_filters[key] = [column.py_to_db(v) for v in val]
+            else:
+                db_filters[key] = column.py_to_db(val)
+        return db_filters
+
+
     def __getitem__(self, key):
         if isinstance(key, slice):
             new_qs = copy.copy(self)
@@ -0,0 +1,174 @@
+import time
+from typing import List
+
+import psycopg
+
+from idli import sql_factory
+from idli.errors import MigrationLockTimeoutError
+
+
+class MigrationStep:
+
+    def __init__(
+        self,
+        description: str,
+        statements: List,
+        lock: str,
+        concurrent: bool = False,
+        isolated: bool = False,
+        batched: bool = False,
+    ):
+        self.description = description
+        self.statements = statements
+        self.lock = lock
+        self.concurrent = concurrent
+        self.isolated = isolated
+        self.batched = batched
+
+
+    def __repr__(self):
+        return f'MigrationStep<{self.lock}> {self.description}'
+
+
+
+class MigrationPlan:
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self.creates_table = False
+        self.steps = []
+
+
+    def __len__(self):
+        return len(self.steps)
+
+
+    def add(
+        self,
+        description: str,
+        statements: List,
+        lock: str = 'ACCESS EXCLUSIVE',
+        concurrent: bool = False,
+        isolated: bool = False,
+        batched: bool = False,
+    ):
+        self.steps.append(MigrationStep(
+            description = description,
+            statements = statements,
+            lock = lock,
+            concurrent = concurrent,
+            isolated = isolated,
+            batched = batched,
+        ))
+
+
+    def batches(self):
+        # Steps that can share a transaction are grouped together. CONCURRENTLY
+        # statements cannot run inside a transaction block, isolated steps must not
+        # hold the locks of their neighbours, and batched steps are repeated in
+        # their own short transactions until their statements run out.
+        batch = []
+        for step in self.steps:
+            if step.concurrent or step.isolated or step.batched:
+                if batch:
+                    yield 'transaction', batch
+                    batch = []
+                if step.concurrent:
+                    yield 'outside', [step]
+                elif step.batched:
+                    yield 'batched', [step]
+                else:
+                    yield 'transaction', [step]
+            else:
+                batch.append(step)
+        if batch:
+            yield 'transaction', batch
+
+
+    def describe(self):
+        lines = [f'Migration plan for table {self.table_name}:']
+        if not self.steps:
+            lines.append('  (nothing to do)')
+
+        n = 0
+        for mode, batch in self.batches():
+            if mode == 'outside':
+                lines.append('  outside transaction:')
+            elif mode == 'batched':
+                lines.append('  repeated in batches:')
+            else:
+                lines.append('  in one transaction:')
+            for step in batch:
+                n += 1
+                lines.append(f'    {n}. {step.description} [lock: {step.lock}]')
+        return '\n'.join(lines)
+
+
+    def apply(
+        self,
+        pool,
+        lock_timeout: int,
+        retries: int,
+        backoff: float,
+    ):
+        for mode, batch in self.batches():
+            if mode == 'outside':
+                self._retry(lambda: _run_outside_transaction(pool, batch, lock_timeout), batch, retries, backoff)
+            elif mode == 'batched':
+                # A retried round is given the same n, so it redoes the same slice
+                n = 0
+                while self._retry(lambda: _run_in_transaction(pool, batch, lock_timeout, n), batch, retries, backoff) > 0:
+                    n += 1
+            else:
+                self._retry(lambda: _run_in_transaction(pool, batch, lock_timeout), batch, retries, backoff)
+
+
+    def _retry(self, fn, batch: List[MigrationStep], retries: int, backoff: float):
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except psycopg.errors.LockNotAvailable:
+                attempt += 1
+                if attempt > retries:
+                    raise MigrationLockTimeoutError(
+                        f"Could not acquire locks for '{batch[0].description}' on table "
+                        f"'{self.table_name}' after {retries} retries"
+                    )
+                time.sleep(backoff * 2 ** (attempt - 1))
+
+
+
+def _run_in_transaction(pool, batch: List[MigrationStep], lock_timeout: int, n: int | None = None):
+    with pool.connection() as conn:
+        with conn.transaction():
+            conn.execute(sql_factory.set_lock_timeout(lock_timeout, local=True))
+            executed = 0
+            for step in batch:
+                for stmt in _statements(step, conn, n):
+                    conn.execute(stmt)
+                    executed += 1
+            return executed
+
+
+def _run_outside_transaction(pool, batch: List[MigrationStep], lock_timeout: int):
+    with pool.connection() as conn:
+        conn.autocommit = True
+        try:
+            conn.execute(sql_factory.set_lock_timeout(lock_timeout))
+            for step in batch:
+                for stmt in _statements(step, conn):
+                    conn.execute(stmt)
+        finally:
+            conn.execute(sql_factory.reset_lock_timeout())
+            conn.autocommit = False
+
+
+def _statements(step: MigrationStep, conn, n: int | None = None):
+    # A statement may be a callable deciding what to run from the current state.
+    # Those of a batched step are also given the round n, and return None when done.
+    for stmt in step.statements:
+        if callable(stmt):
+            stmt = stmt(conn, n) if step.batched else stmt(conn)
+        if stmt is not None:
+            yield stmt
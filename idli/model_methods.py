@@ -1,7 +1,7 @@
 from idli import sql_factory
-from idli.errors import InvalidValueTypeError
-from idli.helpers import AutoInt, AutoUUID
-from idli.internal import PY_COLUMN_TYPES, QuerySet
+from idli.errors import CannotBeNoneError, InvalidValueTypeError, ShardRoutingError
+from idli.helpers import AutoInt
+from idli.internal import QuerySet, server_default
 
 
 def __init__(self, **kwargs):
@@ -21,6 +21,37 @@ def select(cls, **kwargs):
     return QuerySet(cls, filters=kwargs)
 
 
+def get(cls, *pk_values):
+    filters = dict(zip(cls.__primary_key__, pk_values))
+    for obj in QuerySet(cls, filters=filters, limit=1):
+        return obj
+    return None
+
+
+def get_many(cls, ids, chunk_size: int = 1000):
+    # Results are keyed by primary key; composite keys are tuples in PrimaryKey(...) order
+    pk = cls.__primary_key__
+    ids = list(dict.fromkeys(ids))
+    found = {}
+
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i+chunk_size]
+        if len(pk) == 1:
+            for obj in QuerySet(cls, filters={f'{pk[0]}__in': chunk}):
+                found[getattr(obj, pk[0])] = obj
+        else:
+            columns = [cls.__table__.columns[c] for c in pk]
+            keys = [
+                tuple(column.py_to_db(v) for column, v in zip(columns, key))
+                for key in chunk
+            ]
+            for row in cls._connection._query_rows_by_keys(cls, columns, keys):
+                obj = cls._obj_from_dict(row)
+                found[tuple(getattr(obj, c) for c in pk)] = obj
+
+    return found
+
+
 def _obj_from_dict(cls, row_dict):
     obj = cls()
     obj.__original__ = {}
@@ -35,22 +66,23 @@ def _obj_from_dict(cls, row_dict):
 
 
 def _save_existing(self):
+    shard_key = self.__class__.__shard_key__
+    if shard_key is not None and getattr(self, shard_key.column, None) != self.__original__.get(shard_key.column):
+        raise ShardRoutingError(f"Changing shard key column '{shard_key.column}' of a saved row is not supported")
+
     updates = {}
     pk_filter = {}
     for key in self.__table__.columns:
         column = self.__table__.columns[key]
         if hasattr(self, key):
             val = getattr(self, key)
-            val_type = type(val)
             if val is None:
                 if column.nullable:
                     pass
                 else:
                     raise CannotBeNoneError(f"Value for column '{key}' cannot be None")
             else:
-                if val_type not in PY_COLUMN_TYPES:
-                    raise InvalidValueTypeError(f"Invalid value '{val}' for column '{key}'")
-                elif not (column.column_type == PY_COLUMN_TYPES[val_type] or val is None):
+                if not column.accepts(val):
                     raise InvalidValueTypeError(f"Invalid value '{val}' for column '{key}'")
 
             if key in self.__class__.__primary_key__:
@@ -58,11 +90,15 @@ def _save_existing(self):
             else:
                 updates[key] = column.py_to_db(val)
                 
-    self._connection.exec_sql(sql_factory.update_row(
-        table_name = self.__table__.name,
-        pk_filter = pk_filter,
-        updates = updates,
-    ))
+    connection = self._connection._shard_for_values(self.__class__, {**updates, **pk_filter})
+    connection.exec_sql(
+        *sql_factory.update_row(
+            table_name = self.__table__.name,
+            pk_filter = pk_filter,
+            updates = updates,
+        ),
+        binary = True,
+    )
 
 
 def _save_new(self):
@@ -72,19 +108,21 @@ def _save_new(self):
         column = self.__table__.columns[key]
         if hasattr(self, key):
             val = getattr(self, key)
-            if val not in [AutoInt, AutoUUID, None]:
-                val_type = type(val)
-                if val_type not in PY_COLUMN_TYPES:
-                    raise InvalidValueTypeError(f"Invalid value '{val}' for column '{key}'")
-                if column.column_type != PY_COLUMN_TYPES[val_type]:
+            # Unset auto and function defaults are filled in by the database
+            if val is not None and val is not AutoInt and server_default(val) is None:
+                if not column.accepts(val):
                     raise InvalidValueTypeError(f"Invalid value '{val}' for column '{key}'")
                 columns.append(key)
                 values.append(column.py_to_db(val))
                 
-    self._connection.exec_sql(sql_factory.insert_row(
-        table_name = self.__table__.name,
-        columns = columns,
-        values = values,
-    ))
+    connection = self._connection._shard_for_values(self.__class__, dict(zip(columns, values)))
+    connection.exec_sql(
+        *sql_factory.insert_row(
+            table_name = self.__table__.name,
+            columns = columns,
+            values = values,
+        ),
+        binary = True,
+    )
 
                 
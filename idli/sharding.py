@@ -0,0 +1,189 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from functools import cmp_to_key
+import heapq
+from itertools import chain, islice
+from typing import List
+
+from idli import sql_factory
+from idli.connection import BaseConnection, Connection
+from idli.errors import InvalidShardKeyError, ShardRoutingError
+
+
+# Column types whose Python ordering matches Postgres, given that text is
+# sorted with COLLATE "C" (code point order, like Python's str comparison)
+# and NaN is placed by hand
+MERGEABLE_COLUMN_TYPES = (
+    'BOOLEAN', 'BYTEA', 'DATE', 'DOUBLE PRECISION', 'INTEGER',
+    'NUMERIC', 'TIMESTAMP', 'UUID',
+)
+TEXT_COLUMN_TYPES = ('ENUM', 'VARCHAR')
+
+
+class ShardedConnection(BaseConnection):
+
+    def __init__(self, db_uris: List[str], **kwargs):
+        # Every shard is a full Connection with its own per-process pool, so
+        # sambar_dip, migration and pool budget options apply to each database.
+        self._shards = [Connection(db_uri, **kwargs) for db_uri in db_uris]
+
+
+    def _shard_index(self, cls, value):
+        shard_key = cls.__shard_key__
+        if value is None:
+            raise ShardRoutingError(f"Shard key column '{shard_key.column}' must be set to route a row of '{cls.__name__}'")
+        return shard_key.shard_for(value, len(self._shards))
+
+
+    def _shard_for_values(self, cls, values: dict):
+        # Models without a ShardKey live on the first database
+        if cls.__shard_key__ is None:
+            return self._shards[0]
+        return self._shards[self._shard_index(cls, values.get(cls.__shard_key__.column))]
+
+
+    def _shards_for_filters(self, cls, filters: dict | None):
+        shard_key = cls.__shard_key__
+        if shard_key is None:
+            return self._shards[:1]
+
+        # A shard key is never saved as NULL, and "= NULL" matches nothing anyway
+        for key, val in (filters or {}).items():
+            col, op = sql_factory.split_filter_key(key)
+            if col != shard_key.column:
+                continue
+            if op == 'eq':
+                if val is None:
+                    return []
+                return [self._shards[self._shard_index(cls, val)]]
+            if op == 'in':
+                indexes = sorted({self._shard_index(cls, v) for v in val if v is not None})
+                return [self._shards[i] for i in indexes]
+
+        return self._shards
+
+
+    def _fan_out(self, shards, fn):
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            return list(executor.map(fn, shards))
+
+
+    def _query_rows(self, cls, filters, limit, skip, order_by):
+        shards = self._shards_for_filters(cls, filters)
+        if len(shards) == 1:
+            return shards[0]._query_rows(cls, filters, limit, skip, order_by)
+        if len(shards) == 0:
+            return []
+
+        # Each shard returns enough rows to cover skip + limit on its own; the
+        # skip and limit are then applied to the merged stream.
+        skip = skip or 0
+        shard_limit = skip + limit if limit is not None else None
+        c_collated = _c_collated_columns(cls, order_by) if order_by else None
+        results = self._fan_out(
+            shards,
+            lambda shard: shard._query_rows(cls, filters, shard_limit, None, order_by, c_collated).fetchall(),
+        )
+
+        if order_by:
+            rows = heapq.merge(*results, key=_row_sort_key(order_by))
+        else:
+            rows = chain(*results)
+        return islice(rows, skip, shard_limit)
+
+
+    def _query_rows_by_keys(self, cls, columns, keys):
+        shard_key = cls.__shard_key__
+        pk = [c.name for c in columns]
+
+        if shard_key is None:
+            return self._shards[0]._query_rows_by_keys(cls, columns, keys)
+
+        if shard_key.column in pk:
+            i = pk.index(shard_key.column)
+            keys_by_shard = {}
+            for key in keys:
+                keys_by_shard.setdefault(self._shard_index(cls, key[i]), []).append(key)
+        else:
+            keys_by_shard = {n: keys for n in range(len(self._shards))}
+
+        results = self._fan_out(
+            list(keys_by_shard.items()),
+            lambda item: self._shards[item[0]]._query_rows_by_keys(cls, columns, item[1]).fetchall(),
+        )
+        return chain(*results)
+
+
+    def manage_partitions(self, today=None):
+        for shard in self._shards:
+            shard.manage_partitions(today)
+
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+
+
+    def Model(self, cls):
+        # The shard key is checked before any shard is migrated, so a bad
+        # directive never leaves the databases half changed
+        self._declare_model(cls)
+
+        shard_key = cls.__shard_key__
+        if shard_key is not None:
+            if shard_key.column not in cls.__table__.columns:
+                raise InvalidShardKeyError(f"Shard key column '{shard_key.column}' does not exist on model '{cls.__name__}'")
+            if shard_key.method == 'range' and len(shard_key.ranges) != len(self._shards) - 1:
+                raise InvalidShardKeyError(f"Range sharding over {len(self._shards)} databases needs {len(self._shards) - 1} bounds")
+
+        for shard in self._shards:
+            shard._reconcile_model(cls)
+
+        self._bind_model(cls)
+        return cls
+
+
+
+def _c_collated_columns(cls, order_by):
+    # Shards must sort exactly like the merge below, or heapq.merge interleaves
+    # the rows wrongly and skip/limit pick the wrong ones
+    c_collated = []
+    for col_name in order_by:
+        col = col_name.lstrip('-')
+        column = cls.__table__.columns.get(col)
+        if column is None:
+            raise ShardRoutingError(f"Cannot order by unknown column '{col}' across shards")
+        if column.column_type in TEXT_COLUMN_TYPES:
+            c_collated.append(col)
+        elif column.column_type not in MERGEABLE_COLUMN_TYPES:
+            raise ShardRoutingError(f"Cannot merge rows ordered by {column.column_type} column '{col}' across shards")
+    return c_collated
+
+
+def _sort_rank(val):
+    # Postgres sorts NaN above every number and NULL above everything. Python
+    # can't, since every comparison with NaN is False.
+    if val is None:
+        return 2
+    if isinstance(val, (float, Decimal)) and val != val:
+        return 1
+    return 0
+
+
+def _row_sort_key(order_by):
+    # Mirrors Postgres' default ordering, where NULLs sort as the largest value
+    def compare(a, b):
+        for col_name in order_by:
+            desc = col_name.startswith('-')
+            col = col_name.lstrip('-')
+            x, y = a[col], b[col]
+            x_rank, y_rank = _sort_rank(x), _sort_rank(y)
+            if x_rank != y_rank:
+                result = -1 if x_rank < y_rank else 1
+            elif x_rank != 0 or x == y:
+                continue
+            else:
+                result = -1 if x < y else 1
+            return -result if desc else result
+        return 0
+    return cmp_to_key(compare)
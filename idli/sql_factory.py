@@ -1,12 +1,15 @@
 from typing import List
 
-from psycopg.sql import Identifier, Literal, SQL
+from psycopg.adapt import PyFormat
+from psycopg.sql import Identifier, Literal, Placeholder, SQL
 
+from idli.errors import InvalidFilterError
 from idli.helpers import *
-from idli.internal import Column, Table
+from idli.internal import COLUMN_TYPES, Column, Table, server_default
 
 
-DATE_FMT = "%Y-%m-%d %H:%M:%S.%f"
+# Values are sent as parameters in psycopg's binary format rather than as text literals
+PARAM = Placeholder(format=PyFormat.BINARY)
 
 OPERATORS = dict(
     eq = SQL('{} = {}'),
@@ -14,8 +17,102 @@ OPERATORS = dict(
     gte = SQL('{} >= {}'),
     lt = SQL('{} < {}'),
     lte = SQL('{} <= {}'),
+    ne = SQL('{} != {}'),
     neq = SQL('{} != {}'),
+    like = SQL('{} LIKE {}'),
+    ilike = SQL('{} ILIKE {}'),
+    isnull = SQL('{} IS NULL'),
+    between = SQL('{} BETWEEN {} AND {}'),
 )
+# The whole list goes as a single array parameter, whatever its length
+OPERATORS['in'] = SQL('{} = ANY({})')
+
+
+def split_filter_key(key: str):
+    if '__' in key:
+        col, op = key.rsplit('__', 1)
+    else:
+        col, op = key, 'eq'
+    
+    if op not in OPERATORS:
+        raise InvalidFilterError(f"Unsupported operator '{op}' in filter '{key}'")
+    return col, op
+
+
+def filter_condition(col: str, op: str, val):
+    if op == 'isnull':
+        if val:
+            return OPERATORS['isnull'].format(Identifier(col)), []
+        return SQL('{} IS NOT NULL').format(Identifier(col)), []
+    
+    if op == 'between':
+        low, high = val
+        return OPERATORS['between'].format(Identifier(col), PARAM, PARAM), [low, high]
+
+    if op == 'in' and len(val) == 0:
+        return SQL('FALSE'), []
+
+    return OPERATORS[op].format(Identifier(col), PARAM), [val]
+
+
+def add_not_null_check(column: Column):
+    return SQL('ALTER TABLE {} ADD CONSTRAINT {} CHECK ({} IS NOT NULL) NOT VALID').format(
+        Identifier(column.table_name),
+        Identifier(not_null_check_name(column)),
+        Identifier(column.name),
+    )
+
+
+def add_nullable_column(column: Column):
+    return SQL('ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} {}').format(
+        Identifier(column.table_name),
+        Identifier(column.name),
+        SQL(COLUMN_TYPES[column.column_type].sql_type),
+    )
+
+
+def add_primary_key_using_index(table_name: str, index_name: str):
+    return SQL('ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY USING INDEX {}').format(
+        Identifier(table_name),
+        Identifier(table_name + '_pkey'),
+        Identifier(index_name),
+    )
+
+
+def backfill_column_default(column: Column, start_page: int | None = None, end_page: int | None = None):
+    # With a page range this is a TID range scan reading only those pages;
+    # without one it sweeps the whole table
+    stmt = [SQL('UPDATE {} SET {} = DEFAULT WHERE {} IS NULL').format(
+        Identifier(column.table_name),
+        Identifier(column.name),
+        Identifier(column.name),
+    )]
+    if start_page is not None:
+        stmt.append(SQL('AND ctid >= {}::tid AND ctid < {}::tid').format(
+            Literal(f'({start_page},0)'),
+            Literal(f'({end_page},0)'),
+        ))
+    return SQL(' ').join(stmt)
+
+
+def comment_detached_partition(table_name: str, partition_name: str):
+    return SQL('COMMENT ON TABLE {} IS {}').format(
+        Identifier(partition_name),
+        Literal(detached_partition_comment(table_name)),
+    )
+
+
+def create_column_sequence(column: Column):
+    return SQL('CREATE SEQUENCE IF NOT EXISTS {} OWNED BY {}.{}').format(
+        Identifier(column_sequence_name(column)),
+        Identifier(column.table_name),
+        Identifier(column.name),
+    )
+
+
+def column_sequence_name(column: Column):
+    return f'{column.table_name}_{column.name}_seq'
+
 
 def create_primary_key(table_name: str, columns: List[str]):
     return SQL(' ').join([
@@ -31,13 +128,11 @@ def create_primary_key(table_name: str, columns: List[str]):
 
 
 def create_column(column: Column):
-    column_type = column.column_type
+    column_type = COLUMN_TYPES[column.column_type].sql_type
     default = column.default
-    if default == AutoInt and column_type == 'INTEGER':
+    if default == AutoInt and column.column_type == 'INTEGER':
         column_type = 'SERIAL'
         default = None
-    elif default == AutoUUID and column_type == 'UUID':
-        default = 'uuidv7()'
         
     stmt = [
         SQL('ALTER TABLE {}').format(Identifier(column.table_name)),
@@ -51,26 +146,75 @@ def create_column(column: Column):
         stmt.append(SQL('NOT NULL'))
         
     if default != None:
-        if column.column_type == 'TIMESTAMP':
-            stmt.append(SQL('DEFAULT {}').format(Literal(default.strftime(DATE_FMT))))
-        elif default=='uuidv7()':
-            stmt.append(SQL('DEFAULT uuidv7()'))
+        if server_default(default) is not None:
+            stmt.append(SQL('DEFAULT ' + server_default(default)))
         else:
-            stmt.append(SQL('DEFAULT {}').format(Literal(str(default))))
+            stmt.append(SQL('DEFAULT {}').format(Literal(column.py_to_db(default))))
 
     return SQL(' ').join(stmt)
 
 
+def create_unique_index_concurrently(table_name: str, index_name: str, columns: List[str]):
+    return SQL('CREATE UNIQUE INDEX CONCURRENTLY {} ON {} ({})').format(
+        Identifier(index_name),
+        Identifier(table_name),
+        SQL(', ').join([Identifier(c) for c in columns]),
+    )
+
+
+def create_partition(table_name: str, partition_name: str, start, end):
+    return SQL('CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})').format(
+        Identifier(partition_name),
+        Identifier(table_name),
+        Literal(start),
+        Literal(end),
+    )
+
+
+def create_partitioned_table(table_name: str, column: Column):
+    return SQL('CREATE TABLE IF NOT EXISTS {} ({} {}{}) PARTITION BY RANGE ({})').format(
+        Identifier(table_name),
+        Identifier(column.name),
+        SQL(COLUMN_TYPES[column.column_type].sql_type),
+        SQL('' if column.nullable else ' NOT NULL'),
+        Identifier(column.name),
+    )
+
+
 def create_table(table_name: str):
     return SQL('''
         CREATE TABLE IF NOT EXISTS {} ();
     ''').format(Identifier(table_name))
 
 
-def drop_constraint(table_name: str, constraint_name: str):
+def drop_constraint(table_name: str, constraint_name: str, if_exists: bool = False):
     return SQL('''
-        ALTER TABLE {} DROP CONSTRAINT {};
-    ''').format(Identifier(table_name), Identifier(constraint_name))
+        ALTER TABLE {} DROP CONSTRAINT {}{};
+    ''').format(
+        Identifier(table_name),
+        SQL('IF EXISTS ' if if_exists else ''),
+        Identifier(constraint_name),
+    )
+
+
+def detached_partition_comment(table_name: str):
+    return f'detached by idli from {table_name}'
+
+
+def detach_partition_concurrently(table_name: str, partition_name: str, finalize: bool = False):
+    return SQL('ALTER TABLE {} DETACH PARTITION {} {}').format(
+        Identifier(table_name),
+        Identifier(partition_name),
+        SQL('FINALIZE' if finalize else 'CONCURRENTLY'),
+    )
+
+
+def drop_index_concurrently(index_name: str):
+    return SQL('DROP INDEX CONCURRENTLY IF EXISTS {}').format(Identifier(index_name))
+
+
+def drop_table(table_name: str):
+    return SQL('DROP TABLE IF EXISTS {}').format(Identifier(table_name))
 
 
 def get_primary_key_columns(constraint_name: str):
@@ -90,7 +234,7 @@ def get_primary_key_constraint_name(table_name: str):
     ''').format(Literal(table_name))
 
 
-def insert_row(table_name: str, columns: List[str], values: List[str]):
+def insert_row(table_name: str, columns: List[str], values: List):
     return SQL(' ').join([
         SQL('INSERT INTO {}').format(Identifier(table_name)),
         SQL('').join([
@@ -101,20 +245,57 @@ def insert_row(table_name: str, columns: List[str], values: List[str]):
         SQL('VALUES'),
         SQL('').join([
             SQL('('),
-            SQL(', ').join([Literal(v) for v in values]),
+            SQL(', ').join([PARAM for v in values]),
             SQL(')'),
         ]),
-    ])
+    ]), list(values)
 
 
 def list_columns():
     return SQL("""
-        SELECT table_name, column_name, data_type, is_nullable, column_default
+        SELECT table_name, column_name, data_type, udt_name, is_nullable, column_default
         FROM information_schema.columns
         WHERE table_schema = 'public';
     """)
 
 
+def get_relation_pages(table_name: str):
+    return SQL("""
+        SELECT pg_relation_size({}::regclass) / current_setting('block_size')::int;
+    """).format(Literal(table_name))
+
+
+def get_detach_pending(table_name: str, partition_name: str):
+    return SQL("""
+        SELECT i.inhdetachpending
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = {} AND c.relname = {};
+    """).format(Literal(table_name), Literal(partition_name))
+
+
+def list_partitions(table_name: str):
+    # Attached partitions, plus detached tables that still carry a partition name
+    return SQL("""
+        SELECT
+            c.relname AS partition_name,
+            i.inhrelid IS NOT NULL AS attached,
+            COALESCE(i.inhdetachpending, false) AS detach_pending,
+            COALESCE(obj_description(c.oid, 'pg_class') = {}, false) AS detached_by_idli
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+        LEFT JOIN pg_class p ON p.oid = i.inhparent
+        WHERE n.nspname = 'public' AND c.relkind = 'r'
+        AND (p.relname = {} OR (i.inhrelid IS NULL AND c.relname ~ {}));
+    """).format(
+        Literal(detached_partition_comment(table_name)),
+        Literal(table_name),
+        Literal(f'^{table_name}_p[0-9]{{8}}$'),
+    )
+
+
 def list_tables():
     return SQL("""
         SELECT table_name
@@ -124,6 +305,15 @@ def list_tables():
     """)
     
 
+def is_partitioned_table(table_name: str):
+    return SQL("""
+        SELECT 1
+        FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.relname = {};
+    """).format(Literal(table_name))
+
+
 def make_column_nullable(column: Column):
     return SQL('ALTER TABLE {} ALTER COLUMN {} DROP NOT NULL').format(
         Identifier(column.table_name),
@@ -131,65 +321,94 @@ def make_column_nullable(column: Column):
     )
 
 
+def not_null_check_name(column: Column):
+    return f'{column.table_name}_{column.name}_not_null'
+
+
 def query_rows(
         table_name: str,
         filters: dict | None = None,
         limit: int | None = None,
         skip: int | None = None,
         order_by: List | None = None,
+        c_collated: List[str] | None = None,
     ):
     
     stmt = [SQL('SELECT * FROM {}').format(
         Identifier(table_name),
     )]
+    params = []
 
-    if filters is not None:
+    if filters:
         filter_bits = []
         for key, val in filters.items():
-            if '__' in key:
-                col, op = key.split('__')
-            else:
-                col, op = key, 'eq'
-            
-            filter_bits.append(OPERATORS[op].format(Identifier(col), Literal(val)))
+            col, op = split_filter_key(key)
+            condition, condition_params = filter_condition(col, op, val)
+            filter_bits.append(condition)
+            params.extend(condition_params)
                 
         stmt.append(SQL('WHERE ') + SQL(' AND ').join(filter_bits))
     
     if order_by is not None:
         ordering_bits = []
         for col_name in order_by:
+            col = col_name.lstrip('-')
+            bit = Identifier(col)
+            if c_collated and col in c_collated:
+                bit = SQL('{} COLLATE "C"').format(bit)
             if col_name.startswith('-'):
-                ordering_bits.append(SQL('{} DESC').format(Identifier(col_name[1:])))
-            else:
-                ordering_bits.append(Identifier(col_name))
+                bit = SQL('{} DESC').format(bit)
+            ordering_bits.append(bit)
         stmt.append(SQL('ORDER BY ') + SQL(',').join(ordering_bits))
 
     if limit is not None:
-        stmt.append(SQL('LIMIT {}').format(Literal(limit)))
+        stmt.append(SQL('LIMIT {}').format(PARAM))
+        params.append(limit)
     
     if skip is not None:
-        stmt.append(SQL('OFFSET {}').format(Literal(skip)))
+        stmt.append(SQL('OFFSET {}').format(PARAM))
+        params.append(skip)
         
-    return SQL(' ').join(stmt)
+    return SQL(' ').join(stmt), params
+
+
+def query_rows_by_keys(table_name: str, columns: List[Column], keys: List[tuple]):
+    return SQL(' ').join([
+        SQL('SELECT * FROM {}').format(Identifier(table_name)),
+        SQL('WHERE ({}) IN (SELECT * FROM unnest({}))').format(
+            SQL(', ').join([Identifier(c.name) for c in columns]),
+            SQL(', ').join([
+                SQL('{}::{}').format(PARAM, SQL(COLUMN_TYPES[c.column_type].sql_type + '[]'))
+                for c in columns
+            ]),
+        ),
+    ]), [list(values) for values in zip(*keys)]
+
+
+def reset_lock_timeout():
+    return SQL('RESET lock_timeout')
 
 
 def set_default_column_value(column: Column):
     if column.default != None:
-        if column.default == AutoUUID:
-            return SQL('ALTER TABLE {} ALTER COLUMN {} SET DEFAULT uuidv7()').format(
+        if server_default(column.default) is not None:
+            return SQL('ALTER TABLE {} ALTER COLUMN {} SET DEFAULT {}').format(
                 Identifier(column.table_name),
                 Identifier(column.name),
+                SQL(server_default(column.default)),
+            )
+
+        if column.default == AutoInt:
+            return SQL('ALTER TABLE {} ALTER COLUMN {} SET DEFAULT nextval({}::regclass)').format(
+                Identifier(column.table_name),
+                Identifier(column.name),
+                Literal(column_sequence_name(column)),
             )
-            
-        if column.column_type == 'TIMESTAMP':
-            default_str = column.default.strftime(DATE_FMT)
-        else:
-            default_str = str(column.default)
         
         return SQL('ALTER TABLE {} ALTER COLUMN {} SET DEFAULT {}').format(
             Identifier(column.table_name),
             Identifier(column.name),
-            Literal(default_str),
+            Literal(column.py_to_db(column.default)),
         )
     else:
         return SQL('ALTER TABLE {} ALTER COLUMN {} DROP DEFAULT').format(
@@ -198,15 +417,36 @@ def set_default_column_value(column: Column):
         )
 
 
+def set_lock_timeout(milliseconds: int, local: bool = False):
+    return SQL('SET {} lock_timeout = {}').format(
+        SQL('LOCAL') if local else SQL('SESSION'),
+        Literal(f'{int(milliseconds)}ms'),
+    )
+
+
+def set_column_not_null(column: Column):
+    return SQL('ALTER TABLE {} ALTER COLUMN {} SET NOT NULL').format(
+        Identifier(column.table_name),
+        Identifier(column.name),
+    )
+
+
 def update_row(table_name: str, pk_filter: dict, updates: dict):
     return SQL(' ').join([
         SQL('UPDATE {}').format(Identifier(table_name)),
         SQL(' ').join([
             SQL('SET'),
-            SQL(', ').join([SQL('{} = {}').format(Identifier(c), Literal(v)) for c, v in updates.items()]),
+            SQL(', ').join([SQL('{} = {}').format(Identifier(c), PARAM) for c in updates]),
         ]),
         SQL(' ').join([
             SQL('WHERE'),
-            SQL(', ').join([SQL('{} = {}').format(Identifier(c), Literal(v)) for c, v in pk_filter.items()]),
+            SQL(' AND ').join([SQL('{} = {}').format(Identifier(c), PARAM) for c in pk_filter]),
         ]),
-    ])
+    ]), list(updates.values()) + list(pk_filter.values())
+
+
+def validate_constraint(table_name: str, constraint_name: str):
+    return SQL('ALTER TABLE {} VALIDATE CONSTRAINT {}').format(
+        Identifier(table_name),
+        Identifier(constraint_name),
+    )
@@ -0,0 +1,70 @@
+from contextlib import contextmanager
+
+import psycopg
+
+
+class FakeResult:
+    # Stands in for a psycopg cursor
+
+    def __init__(self, rows=None):
+        self._rows = rows or []
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+class FakeConn:
+    # Stands in for a psycopg connection, returning the same rows for every query
+
+    def __init__(self, rows=None):
+        self.rows = rows
+
+    def execute(self, *args, **kwargs):
+        return FakeResult(self.rows)
+
+
+def bare(connection_class, **attrs):
+    # Skips __init__, so nothing connects to or loads from a database
+    connection = object.__new__(connection_class)
+    for key, val in attrs.items():
+        setattr(connection, key, val)
+    return connection
+
+
+class FakePool:
+    # Records what each pooled connection runs. The first `lock_failures`
+    # statements raise LockNotAvailable, as a lock timeout would.
+
+    def __init__(self, lock_failures=0):
+        self.lock_failures = lock_failures
+        self.transactions = []
+
+    @contextmanager
+    def connection(self):
+        yield FakePooledConn(self)
+
+
+class FakePooledConn:
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.autocommit = False
+        self.executed = []
+        pool.transactions.append(self.executed)
+
+    @contextmanager
+    def transaction(self):
+        yield
+
+    def execute(self, stmt, *args, **kwargs):
+        if self.pool.lock_failures > 0:
+            self.pool.lock_failures -= 1
+            raise psycopg.errors.LockNotAvailable()
+        self.executed.append((self.autocommit, stmt.as_string(None)))
+        return FakeResult()
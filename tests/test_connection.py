@@ -0,0 +1,307 @@
+from datetime import date, datetime
+from decimal import Decimal
+import gc
+import uuid
+import weakref
+
+import pytest
+
+from conftest import FakeConn, FakeResult, bare
+from idli import connection as connection_module
+from idli.connection import Connection, _backfill_statement, _detach_partition_statement
+from idli.errors import InvalidDefaultError
+from idli.helpers import AutoInt, AutoUUID, Partition, PrimaryKey
+from idli.internal import Column, Table
+from idli.migrations import MigrationPlan
+
+
+def make_connection(db_table):
+    # Reconciliation only reads the loaded schema, so no database is needed
+    return bare(Connection, _sambar_dip=False, __db_tables__={db_table.name: db_table})
+
+
+@pytest.mark.parametrize('db_default, default', [(None, None), ('0.1', 0.1)])
+def test_float_field_accepts_legacy_numeric_column(db_default, default):
+    db_table = Table('reading')
+    db_table.add_column(Column.from_db_row(
+        table_name = 'reading',
+        column_name = 'value',
+        data_type = 'numeric',
+        udt_name = 'numeric',
+        is_nullable = 'NO',
+        column_default = db_default,
+    ))
+
+    class Reading:
+        __table__ = Table('reading')
+    column = Column.from_py_model('reading', 'value', float, default=default)
+    Reading.__table__.add_column(column)
+
+    plan = MigrationPlan('reading')
+    make_connection(db_table)._reconcile_columns(Reading, plan)
+    assert len(plan) == 0
+
+    loaded = column.db_val_to_py_val(Decimal('1.5'))
+    assert loaded == 1.5 and type(loaded) is float
+
+
+def test_connections_are_not_kept_alive_by_fork_and_exit_hooks(monkeypatch):
+    # The pool is lazy, so nothing touches the database when schema loading is skipped
+    monkeypatch.setattr(Connection, 'load_tables', lambda self: None)
+    monkeypatch.setattr(Connection, 'load_columns', lambda self: None)
+
+    connection = Connection('postgresql://localhost/idli_test')
+    assert connection in connection_module._connections
+
+    old_lock = connection._pool_lock
+    connection_module._after_fork_in_child()
+    assert connection._pool_lock is not old_lock
+
+    ref = weakref.ref(connection)
+    del connection
+    gc.collect()
+    assert ref() is None
+
+
+def test_pool_size_respects_connection_budget(monkeypatch):
+    monkeypatch.setattr(Connection, 'load_tables', lambda self: None)
+    monkeypatch.setattr(Connection, 'load_columns', lambda self: None)
+
+    connection = Connection('postgresql://localhost/idli_test', pool_size=10, max_connections=24, processes=4)
+    assert connection._pool_max_size() == 6
+
+    connection = Connection('postgresql://localhost/idli_test', pool_size=4, max_connections=100, processes=4)
+    assert connection._pool_max_size() == 4
+
+
+def plan_partitions(rows, partition):
+    class Task:
+        __table__ = Table('task')
+        __partition__ = partition
+
+    connection = bare(Connection, exec_sql_to_dict_rows=lambda *args, **kwargs: FakeResult(rows))
+    plan = MigrationPlan('task')
+    connection._reconcile_partitions(Task, plan, today=date(2025, 10, 19))
+    return plan
+
+
+def partition_row(name, attached=True, detach_pending=False, detached_by_idli=False):
+    return {'partition_name': name, 'attached': attached, 'detach_pending': detach_pending, 'detached_by_idli': detached_by_idli}
+
+
+def test_partitions_are_created_and_expired():
+    rows = [partition_row('task_p20250701'), partition_row('task_p20250901'), partition_row('task_p20251001')]
+    plan = plan_partitions(rows, Partition('created', 'month', retain=1, premake=1))
+    assert [step.description for step in plan.steps] == [
+        'create partition task_p20251101',
+        'detach partition task_p20250701',
+        'drop table task_p20250701',
+    ]
+    # Marked before detaching, so a later run can tell it apart from a table detached by hand
+    assert plan.steps[1].statements[0].as_string(None) == (
+        'COMMENT ON TABLE "task_p20250701" IS \'detached by idli from task\''
+    )
+
+
+def test_pending_detach_is_finalized_and_only_tables_idli_detached_are_dropped():
+    rows = [
+        partition_row('task_p20250601', detach_pending=True, detached_by_idli=True),
+        partition_row('task_p20250801', detach_pending=True),
+        partition_row('task_p20250501', attached=False, detached_by_idli=True),
+        partition_row('task_p20250401', attached=False),
+        partition_row('task_p20251001'),
+    ]
+    plan = plan_partitions(rows, Partition('created', 'month', retain=3, premake=0))
+    assert [step.description for step in plan.steps] == [
+        'detach partition task_p20250601',
+        'drop table task_p20250601',
+        'detach partition task_p20250801',
+        'drop detached table task_p20250501',
+    ]
+    assert len(plan.steps[2].statements) == 1
+
+
+def test_detach_statement_finalizes_a_pending_detach():
+    statement = _detach_partition_statement('task', 'task_p20250601')
+    assert statement(FakeConn([(True,)])).as_string(None).endswith('FINALIZE')
+    assert statement(FakeConn([(False,)])).as_string(None).endswith('CONCURRENTLY')
+    assert statement(FakeConn([])) is None
+
+
+def test_backfill_walks_the_table_by_page_ranges():
+    column = Column('task', 'seq', 'INTEGER', default=AutoInt)
+    statement = _backfill_statement(column, pages=100)
+    conn = FakeConn([(250,)])
+
+    rounds = []
+    n = 0
+    while (stmt := statement(conn, n)) is not None:
+        rounds.append(stmt.as_string(None))
+        n += 1
+
+    update = 'UPDATE "task" SET "seq" = DEFAULT WHERE "seq" IS NULL'
+    assert rounds == [
+        update + " AND ctid >= '(0,0)'::tid AND ctid < '(100,0)'::tid",
+        update + " AND ctid >= '(100,0)'::tid AND ctid < '(200,0)'::tid",
+        update + " AND ctid >= '(200,0)'::tid AND ctid < '(300,0)'::tid",
+        update,
+    ]
+
+
+def planned(plan):
+    # Each step as (mode, description, statements), resolving callable statements to their name
+    return [
+        (mode, step.description, [
+            stmt.__qualname__.split('.')[0] if callable(stmt) else stmt.as_string(None)
+            for stmt in step.statements
+        ])
+        for mode, batch in plan.batches()
+        for step in batch
+    ]
+
+
+def test_primary_key_change_builds_the_index_concurrently_then_swaps_it_in():
+    class Task:
+        __table__ = Table('task')
+        __primary_key__ = ['id', 'owner']
+        __partition__ = None
+
+    plan = MigrationPlan('task')
+    bare(Connection)._plan_primary_key(Task, plan, 'task_pkey')
+    assert planned(plan) == [
+        ('outside', 'build unique index task_pkey_new (id, owner) concurrently', [
+            'DROP INDEX CONCURRENTLY IF EXISTS "task_pkey_new"',
+            'CREATE UNIQUE INDEX CONCURRENTLY "task_pkey_new" ON "task" ("id", "owner")',
+        ]),
+        ('transaction', 'swap in primary key using index task_pkey_new', [
+            '\n        ALTER TABLE "task" DROP CONSTRAINT "task_pkey";\n    ',
+            'ALTER TABLE "task" ADD CONSTRAINT "task_pkey" PRIMARY KEY USING INDEX "task_pkey_new"',
+        ]),
+    ]
+    assert plan.steps[0].lock == 'SHARE UPDATE EXCLUSIVE'
+    assert plan.steps[1].lock == 'ACCESS EXCLUSIVE'
+
+
+def test_new_primary_key_on_a_new_table_is_added_directly():
+    class Task:
+        __table__ = Table('task')
+        __primary_key__ = ['id']
+        __partition__ = None
+
+    plan = MigrationPlan('task')
+    plan.creates_table = True
+    bare(Connection)._plan_primary_key(Task, plan)
+    assert planned(plan) == [
+        ('transaction', 'add primary key (id)', ['ALTER TABLE "task" ADD CONSTRAINT "task_pkey" PRIMARY KEY ("id")']),
+    ]
+
+
+def test_auto_column_is_added_nullable_backfilled_then_made_not_null():
+    db_table = Table('task')
+    db_table.add_column(Column('task', 'id', 'INTEGER'))
+    connection = make_connection(db_table)
+    connection._sambar_dip = True
+    connection._backfill_batch_pages = 100
+
+    class Task:
+        id: int
+        seq: int = AutoInt
+    connection._declare_model(Task)
+
+    plan = MigrationPlan('task')
+    connection._reconcile_columns(Task, plan)
+    check = '"task_seq_not_null"'
+    assert planned(plan) == [
+        ('transaction', "add column 'seq' as nullable with its default", [
+            'ALTER TABLE "task" ADD COLUMN IF NOT EXISTS "seq" INTEGER',
+            'CREATE SEQUENCE IF NOT EXISTS "task_seq_seq" OWNED BY "task"."seq"',
+            'ALTER TABLE "task" ALTER COLUMN "seq" SET DEFAULT nextval(\'task_seq_seq\'::regclass)',
+        ]),
+        ('batched', "backfill column 'seq' in batches of 100 pages", ['_backfill_statement']),
+        ('transaction', 'add NOT VALID check task_seq_not_null', [
+            f'\n        ALTER TABLE "task" DROP CONSTRAINT IF EXISTS {check};\n    ',
+            f'ALTER TABLE "task" ADD CONSTRAINT {check} CHECK ("seq" IS NOT NULL) NOT VALID',
+        ]),
+        ('transaction', 'validate check task_seq_not_null', [
+            f'ALTER TABLE "task" VALIDATE CONSTRAINT {check}',
+        ]),
+        ('transaction', "set column 'seq' NOT NULL using check task_seq_not_null", [
+            'ALTER TABLE "task" ALTER COLUMN "seq" SET NOT NULL',
+            f'\n        ALTER TABLE "task" DROP CONSTRAINT {check};\n    ',
+        ]),
+    ]
+    assert [step.isolated for step in plan.steps[2:]] == [True, True, True]
+    assert plan.steps[3].lock == 'SHARE UPDATE EXCLUSIVE'
+
+
+def test_interrupted_auto_column_is_resumed():
+    db_table = Table('task')
+    db_table.add_column(Column('task', 'id', 'INTEGER'))
+    db_table.add_column(Column('task', 'seq', 'INTEGER', nullable=True, default=AutoInt))
+    connection = make_connection(db_table)
+    connection._sambar_dip = True
+    connection._backfill_batch_pages = 100
+
+    class Task:
+        id: int
+        seq: int = AutoInt
+    connection._declare_model(Task)
+
+    plan = MigrationPlan('task')
+    connection._reconcile_columns(Task, plan)
+    assert [step.description for step in plan.steps] == [
+        "set default of column 'seq'",
+        "backfill column 'seq' in batches of 100 pages",
+        'add NOT VALID check task_seq_not_null',
+        'validate check task_seq_not_null',
+        "set column 'seq' NOT NULL using check task_seq_not_null",
+    ]
+    assert not any('ADD COLUMN' in stmt for _, _, stmts in planned(plan) for stmt in stmts)
+
+
+def test_function_defaults_are_left_to_the_database():
+    connection = bare(Connection, _sambar_dip=True, __db_tables__={})
+
+    class Task:
+        id: uuid.UUID = AutoUUID
+        created: datetime = datetime.now
+
+        __idli__ = [PrimaryKey('id', 'created'), Partition(by='created')]
+    connection._declare_model(Task)
+
+    plan = MigrationPlan('task')
+    connection._ensure_table(Task, plan)
+    connection._reconcile_columns(Task, plan)
+    statements = [stmt for _, _, stmts in planned(plan) for stmt in stmts]
+    assert 'ALTER TABLE "task" ADD COLUMN IF NOT EXISTS "id" UUID NOT NULL DEFAULT uuidv7()' in statements
+    assert 'ALTER TABLE "task" ALTER COLUMN "created" SET DEFAULT now()' in statements
+
+
+@pytest.mark.parametrize('udt_name, db_default, py_class, default', [
+    ('timestamp', 'now()', datetime, datetime.now),
+    ('date', 'CURRENT_DATE', date, date.today),
+    ('uuid', 'gen_random_uuid()', uuid.UUID, uuid.uuid4),
+])
+def test_function_defaults_read_back_from_the_database_match(udt_name, db_default, py_class, default):
+    db_table = Table('task')
+    db_table.add_column(Column.from_db_row(
+        table_name = 'task',
+        column_name = 'c',
+        data_type = udt_name,
+        udt_name = udt_name,
+        is_nullable = 'NO',
+        column_default = db_default,
+    ))
+
+    class Task:
+        __table__ = Table('task')
+    Task.__table__.add_column(Column.from_py_model('task', 'c', py_class, default=default))
+
+    plan = MigrationPlan('task')
+    make_connection(db_table)._reconcile_columns(Task, plan)
+    assert len(plan) == 0
+
+
+def test_unsupported_function_default_is_rejected():
+    with pytest.raises(InvalidDefaultError):
+        Column.from_py_model('task', 'created', datetime, default=lambda: datetime(2025, 1, 1))
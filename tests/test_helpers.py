@@ -0,0 +1,39 @@
+from datetime import date, datetime
+
+import pytest
+
+from idli.errors import InvalidPartitionError
+from idli.helpers import Partition
+
+
+def test_period_start():
+    moment = datetime(2025, 10, 19, 15, 30)
+    assert Partition('created', 'day').period_start(moment) == date(2025, 10, 19)
+    assert Partition('created', 'week').period_start(moment) == date(2025, 10, 13)
+    assert Partition('created', 'month').period_start(moment) == date(2025, 10, 1)
+    assert Partition('created', 'year').period_start(moment) == date(2025, 1, 1)
+
+
+def test_shift_crosses_year_boundaries():
+    monthly = Partition('created', 'month')
+    assert monthly.shift(date(2025, 12, 1), 1) == date(2026, 1, 1)
+    assert monthly.shift(date(2025, 1, 1), -1) == date(2024, 12, 1)
+    assert monthly.shift(date(2025, 12, 1), -13) == date(2024, 11, 1)
+
+    assert Partition('created', 'week').shift(date(2025, 12, 29), 1) == date(2026, 1, 5)
+    assert Partition('created', 'day').shift(date(2024, 2, 28), 1) == date(2024, 2, 29)
+    assert Partition('created', 'year').shift(date(2025, 1, 1), -2) == date(2023, 1, 1)
+
+
+def test_partition_names_round_trip():
+    monthly = Partition('created', 'month')
+    name = monthly.partition_name('task', date(2025, 12, 1))
+    assert name == 'task_p20251201'
+    assert monthly.partition_start('task', name) == date(2025, 12, 1)
+    assert monthly.partition_start('task', 'task_default') is None
+    assert monthly.partition_start('task', 'other_p20251201') is None
+
+
+def test_unknown_interval_is_rejected():
+    with pytest.raises(InvalidPartitionError):
+        Partition('created', 'fortnight')
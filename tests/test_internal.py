@@ -0,0 +1,51 @@
+from datetime import date, datetime
+from enum import Enum, IntEnum, StrEnum
+
+from idli.internal import Column, column_type_for
+
+
+class Status(str, Enum):
+    TODO = 'todo'
+    DONE = 'done'
+
+
+class Colour(StrEnum):
+    RED = 'red'
+
+
+class Priority(IntEnum):
+    LOW = 1
+    HIGH = 2
+
+
+def test_enum_mixins_map_to_enum_column():
+    assert column_type_for(Status) == 'ENUM'
+    assert column_type_for(Colour) == 'ENUM'
+    assert column_type_for(Priority) == 'ENUM'
+
+
+def test_plain_types_are_unaffected():
+    assert column_type_for(str) == 'VARCHAR'
+    assert column_type_for(int) == 'INTEGER'
+    assert column_type_for(bool) == 'BOOLEAN'
+
+
+def test_enum_values_round_trip_as_members():
+    for enum_class in (Status, Colour, Priority):
+        column = Column.from_py_model('task', 'c', enum_class)
+        for member in enum_class:
+            db_val = column.py_to_db(member)
+            assert isinstance(db_val, str)
+            loaded = column.db_val_to_py_val(db_val)
+            assert loaded is member
+
+
+def test_accepts_rejects_subclasses_the_database_would_coerce():
+    date_column = Column.from_py_model('task', 'due', date)
+    assert date_column.accepts(date(2025, 10, 19))
+    assert not date_column.accepts(datetime(2025, 10, 19, 15, 30))
+    assert Column.from_py_model('task', 'created', datetime).accepts(datetime(2025, 10, 19, 15, 30))
+
+    int_column = Column.from_py_model('task', 'points', int)
+    assert int_column.accepts(3)
+    assert not int_column.accepts(True)
@@ -0,0 +1,96 @@
+import pytest
+from psycopg.sql import SQL
+
+from conftest import FakePool
+from idli import migrations
+from idli.errors import MigrationLockTimeoutError
+from idli.migrations import MigrationPlan
+
+
+def test_batches_group_steps_that_can_share_a_transaction():
+    plan = MigrationPlan('task')
+    plan.add('a', [])
+    plan.add('b', [])
+    plan.add('c', [], concurrent=True)
+    plan.add('d', [], isolated=True)
+    plan.add('e', [], batched=True)
+    plan.add('f', [])
+
+    batches = [(mode, [step.description for step in batch]) for mode, batch in plan.batches()]
+    assert batches == [
+        ('transaction', ['a', 'b']),
+        ('outside', ['c']),
+        ('transaction', ['d']),
+        ('batched', ['e']),
+        ('transaction', ['f']),
+    ]
+
+
+def test_describe():
+    plan = MigrationPlan('task')
+    assert plan.describe() == 'Migration plan for table task:\n  (nothing to do)'
+
+    plan.add("add column 'owner'", [])
+    plan.add('build unique index task_pkey_new (id) concurrently', [], lock='SHARE UPDATE EXCLUSIVE', concurrent=True)
+    plan.add('swap in primary key using index task_pkey_new', [])
+    plan.add("backfill column 'seq' in batches of 100 pages", [], lock='ROW EXCLUSIVE', batched=True)
+    assert plan.describe() == '\n'.join([
+        'Migration plan for table task:',
+        '  in one transaction:',
+        "    1. add column 'owner' [lock: ACCESS EXCLUSIVE]",
+        '  outside transaction:',
+        '    2. build unique index task_pkey_new (id) concurrently [lock: SHARE UPDATE EXCLUSIVE]',
+        '  in one transaction:',
+        '    3. swap in primary key using index task_pkey_new [lock: ACCESS EXCLUSIVE]',
+        '  repeated in batches:',
+        "    4. backfill column 'seq' in batches of 100 pages [lock: ROW EXCLUSIVE]",
+    ])
+
+
+def test_apply_runs_each_batch_with_a_lock_timeout():
+    plan = MigrationPlan('task')
+    plan.add('a', [SQL('A1'), SQL('A2')])
+    plan.add('c', [SQL('C')], concurrent=True)
+
+    pool = FakePool()
+    plan.apply(pool, lock_timeout=2000, retries=0, backoff=0)
+    assert pool.transactions == [
+        [(False, "SET LOCAL lock_timeout = '2000ms'"), (False, 'A1'), (False, 'A2')],
+        [(True, "SET SESSION lock_timeout = '2000ms'"), (True, 'C'), (True, 'RESET lock_timeout')],
+    ]
+
+
+def test_batched_step_repeats_until_its_statements_run_out():
+    rounds = []
+    def statement(conn, n):
+        rounds.append(n)
+        return SQL(f'ROUND {n}') if n < 3 else None
+
+    plan = MigrationPlan('task')
+    plan.add('backfill', [statement], lock='ROW EXCLUSIVE', batched=True)
+
+    # The lock timeout in round 0 is retried with the same n
+    pool = FakePool(lock_failures=1)
+    plan.apply(pool, lock_timeout=2000, retries=1, backoff=0)
+    assert rounds == [0, 1, 2, 3]
+    assert [[stmt for _, stmt in t[1:]] for t in pool.transactions] == [
+        [], ['ROUND 0'], ['ROUND 1'], ['ROUND 2'], [],
+    ]
+
+
+def test_retry_backs_off_exponentially_then_gives_up(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(migrations.time, 'sleep', sleeps.append)
+
+    plan = MigrationPlan('task')
+    plan.add('a', [SQL('A')])
+
+    pool = FakePool(lock_failures=2)
+    plan.apply(pool, lock_timeout=2000, retries=2, backoff=0.5)
+    assert sleeps == [0.5, 1.0]
+    assert pool.transactions[-1] == [(False, "SET LOCAL lock_timeout = '2000ms'"), (False, 'A')]
+
+    sleeps.clear()
+    with pytest.raises(MigrationLockTimeoutError):
+        plan.apply(FakePool(lock_failures=10), lock_timeout=2000, retries=3, backoff=0.5)
+    assert sleeps == [0.5, 1.0, 2.0]
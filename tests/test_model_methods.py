@@ -0,0 +1,95 @@
+from enum import Enum, IntEnum
+
+from idli.connection import BaseConnection
+from idli.helpers import PrimaryKey
+from idli.internal import QuerySet
+
+
+class Status(str, Enum):
+    TODO = 'todo'
+    DONE = 'done'
+
+
+class Priority(IntEnum):
+    LOW = 1
+    HIGH = 2
+
+
+class RecordingConnection(BaseConnection):
+    # Answers queries from a list of rows and records what was asked
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def _query_rows(self, cls, filters, limit, skip, order_by):
+        self.queries.append(filters)
+        (key, ids), = filters.items()
+        return [row for row in self.rows if row[key.removesuffix('__in')] in ids]
+
+    def _query_rows_by_keys(self, cls, columns, keys):
+        self.queries.append(keys)
+        names = [c.name for c in columns]
+        return [row for row in self.rows if tuple(row[c] for c in names) in keys]
+
+
+def bind(connection, cls):
+    connection._declare_model(cls)
+    connection._bind_model(cls)
+    return cls
+
+
+def test_get_many_chunks_deduplicates_and_keys_by_primary_key():
+    connection = RecordingConnection([{'id': i, 'title': f'task {i}'} for i in range(10)])
+
+    class Task:
+        id: int
+        title: str
+    bind(connection, Task)
+
+    found = Task.get_many([1, 2, 2, 3, 42, 1, 4], chunk_size=2)
+    assert connection.queries == [{'id__in': [1, 2]}, {'id__in': [3, 42]}, {'id__in': [4]}]
+    assert sorted(found) == [1, 2, 3, 4]
+    assert found[3].title == 'task 3'
+
+
+def test_get_many_with_composite_key_is_keyed_by_tuple():
+    connection = RecordingConnection([
+        {'team': t, 'status': s, 'title': f'{t}-{s}'}
+        for t in ('a', 'b') for s in ('todo', 'done')
+    ])
+
+    class Board:
+        team: str
+        status: Status
+        title: str
+
+        __idli__ = [PrimaryKey('team', 'status')]
+    bind(connection, Board)
+
+    found = Board.get_many([('a', Status.DONE), ('b', Status.TODO), ('a', Status.DONE), ('c', Status.TODO)])
+    assert connection.queries == [[('a', 'done'), ('b', 'todo'), ('c', 'todo')]]
+    assert sorted(found) == [('a', Status.DONE), ('b', Status.TODO)]
+    assert found[('a', Status.DONE)].title == 'a-done'
+    assert found[('a', Status.DONE)].status is Status.DONE
+
+
+def test_list_filters_are_converted_per_element():
+    class Task:
+        id: int
+        status: Status
+        priority: Priority
+    bind(RecordingConnection([]), Task)
+
+    filters = QuerySet(Task, filters={
+        'status__in': [Status.TODO, Status.DONE],
+        'priority__between': (Priority.LOW, Priority.HIGH),
+        'status': Status.DONE,
+        'id__isnull': False,
+    })._db_filters()
+    assert filters == {
+        'status__in': ['todo', 'done'],
+        'priority__between': ['1', '2'],
+        'status': 'done',
+        'id__isnull': False,
+    }
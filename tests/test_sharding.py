@@ -0,0 +1,205 @@
+import math
+
+import pytest
+
+from conftest import FakeResult, bare
+from idli import ShardedConnection, ShardKey
+from idli.errors import InvalidShardKeyError, ShardRoutingError
+
+
+class FakeShard:
+
+    def __init__(self, rows=None):
+        self.rows = rows or []
+        self.reconciled = []
+        self.queries = []
+
+    def _reconcile_model(self, cls):
+        self.reconciled.append(cls)
+
+
+def sharded(*shards):
+    return bare(ShardedConnection, _shards=list(shards))
+
+
+def test_bad_shard_key_is_rejected_before_any_shard_is_migrated():
+    shards = [FakeShard(), FakeShard()]
+    db = sharded(*shards)
+
+    with pytest.raises(InvalidShardKeyError):
+        @db.Model
+        class Task:
+            id: int
+            owner: str
+
+            __idli__ = [ShardKey('missing')]
+
+    with pytest.raises(InvalidShardKeyError):
+        @db.Model
+        class Note:
+            id: int
+            owner: str
+
+            __idli__ = [ShardKey('owner', method='range', ranges=['h', 'p'])]
+
+    assert all(shard.reconciled == [] for shard in shards)
+
+
+def test_models_are_reconciled_on_every_shard_and_bound_to_the_sharded_connection():
+    shards = [FakeShard(), FakeShard()]
+    db = sharded(*shards)
+
+    @db.Model
+    class Task:
+        id: int
+        owner: str
+
+        __idli__ = [ShardKey('owner')]
+
+    assert all(shard.reconciled == [Task] for shard in shards)
+    assert Task._connection is db
+
+
+class SortingShard(FakeShard):
+    # Sorts like Postgres would: NaN above numbers and NULLs last ascending, and
+    # text in a case-insensitive, en_US-like collation unless COLLATE "C" is requested
+
+    def _query_rows(self, cls, filters, limit, skip, order_by, c_collated=None):
+        self.queries.append(dict(filters=filters, limit=limit, skip=skip, order_by=order_by, c_collated=c_collated))
+        rows = list(self.rows)
+        for col_name in reversed(order_by or []):
+            col = col_name.lstrip('-')
+            def key(row):
+                val = row[col]
+                if isinstance(val, str) and col not in (c_collated or []):
+                    val = val.lower()
+                if val is None:
+                    return (2, 0)
+                if isinstance(val, float) and math.isnan(val):
+                    return (1, 0)
+                return (0, val)
+            rows.sort(key=key, reverse=col_name.startswith('-'))
+        rows = rows[skip or 0:]
+        return FakeResult(rows[:limit] if limit is not None else rows)
+
+
+def declare(db, *directives):
+    @db.Model
+    class Task:
+        id: int
+        owner: str
+        title: str
+        points: int | None
+        score: float | None
+        meta: dict | None
+
+        __idli__ = list(directives)
+    return Task
+
+
+def test_hash_shard_key_is_stable():
+    shard_key = ShardKey('owner')
+    assert shard_key.shard_for('alice', 4) == shard_key.shard_for('alice', 4)
+    assert {shard_key.shard_for(f'user{i}', 4) for i in range(100)} == {0, 1, 2, 3}
+
+
+def test_range_shard_key():
+    shard_key = ShardKey('owner', method='range', ranges=['p', 'h'])
+    assert shard_key.shard_for('alice', 3) == 0
+    assert shard_key.shard_for('h', 3) == 1
+    assert shard_key.shard_for('mallory', 3) == 1
+    assert shard_key.shard_for('zoe', 3) == 2
+
+
+def test_filters_on_shard_key_route_to_owning_shards():
+    shards = [SortingShard(), SortingShard(), SortingShard()]
+    db = sharded(*shards)
+    Task = declare(db, ShardKey('owner', method='range', ranges=['h', 'p']))
+
+    assert db._shards_for_filters(Task, {'owner': 'alice'}) == [shards[0]]
+    assert db._shards_for_filters(Task, {'owner__in': ['zoe', 'bob']}) == [shards[0], shards[2]]
+    assert db._shards_for_filters(Task, {'owner__in': []}) == []
+    assert db._shards_for_filters(Task, {'owner': None}) == []
+    assert db._shards_for_filters(Task, {'owner__in': ['zoe', None]}) == [shards[2]]
+    assert list(db._query_rows(Task, {'owner': None}, limit=None, skip=None, order_by=None)) == []
+    assert db._shards_for_filters(Task, {'title': 'x'}) == shards
+    assert db._shards_for_filters(Task, None) == shards
+
+
+def test_fan_out_merges_in_order_and_applies_skip_and_limit_once():
+    shards = [
+        SortingShard([{'points': p, 'title': 't'} for p in (1, 4, 7, 10)]),
+        SortingShard([{'points': p, 'title': 't'} for p in (2, 5, 8)]),
+        SortingShard([{'points': p, 'title': 't'} for p in (3, 6, 9)]),
+    ]
+    db = sharded(*shards)
+    Task = declare(db, ShardKey('owner'))
+
+    rows = list(db._query_rows(Task, None, limit=4, skip=3, order_by=['points']))
+    assert [r['points'] for r in rows] == [4, 5, 6, 7]
+    assert all(q['limit'] == 7 and q['skip'] is None for shard in shards for q in shard.queries)
+
+    rows = list(db._query_rows(Task, None, limit=None, skip=8, order_by=['-points']))
+    assert [r['points'] for r in rows] == [2, 1]
+
+
+def test_fan_out_orders_nulls_like_postgres():
+    shards = [
+        SortingShard([{'points': p} for p in (1, None)]),
+        SortingShard([{'points': p} for p in (2, None, 0)]),
+    ]
+    db = sharded(*shards)
+    Task = declare(db, ShardKey('owner'))
+
+    rows = list(db._query_rows(Task, None, limit=None, skip=None, order_by=['points']))
+    assert [r['points'] for r in rows] == [0, 1, 2, None, None]
+
+    rows = list(db._query_rows(Task, None, limit=None, skip=None, order_by=['-points']))
+    assert [r['points'] for r in rows] == [None, None, 2, 1, 0]
+
+    # NaN sorts above every number and below NULL
+    nan = float('nan')
+    shards = [
+        SortingShard([{'score': s} for s in (nan, 1.5, None, -2.0)]),
+        SortingShard([{'score': s} for s in (0.5, nan, 3.0)]),
+    ]
+    db = sharded(*shards)
+    Task = declare(db, ShardKey('owner'))
+
+    rows = list(db._query_rows(Task, None, limit=None, skip=None, order_by=['score']))
+    assert [str(r['score']) for r in rows] == ['-2.0', '0.5', '1.5', '3.0', 'nan', 'nan', 'None']
+
+    rows = list(db._query_rows(Task, None, limit=3, skip=1, order_by=['-score']))
+    assert [str(r['score']) for r in rows] == ['nan', 'nan', '3.0']
+
+
+def test_fan_out_orders_text_by_code_point_on_every_shard():
+    shards = [
+        SortingShard([{'title': t} for t in ('a', 'B', 'c')]),
+        SortingShard([{'title': t} for t in ('A', 'b', 'C')]),
+    ]
+    db = sharded(*shards)
+    Task = declare(db, ShardKey('owner'))
+
+    rows = list(db._query_rows(Task, None, limit=4, skip=1, order_by=['title']))
+    assert [r['title'] for r in rows] == ['B', 'C', 'a', 'b']
+    assert all(q['c_collated'] == ['title'] for shard in shards for q in shard.queries)
+
+
+def test_fan_out_rejects_order_by_without_a_matching_python_order():
+    db = sharded(SortingShard(), SortingShard())
+    Task = declare(db, ShardKey('owner'))
+
+    with pytest.raises(ShardRoutingError):
+        list(db._query_rows(Task, None, limit=None, skip=None, order_by=['meta']))
+
+
+def test_single_shard_queries_are_passed_through():
+    shards = [SortingShard([{'title': 'x'}]), SortingShard([{'title': 'y'}])]
+    db = sharded(*shards)
+    Task = declare(db, ShardKey('owner', method='range', ranges=['m']))
+
+    rows = list(db._query_rows(Task, {'owner': 'zoe'}, limit=5, skip=2, order_by=['title']))
+    assert rows == []
+    assert shards[0].queries == []
+    assert shards[1].queries == [dict(filters={'owner': 'zoe'}, limit=5, skip=2, order_by=['title'], c_collated=None)]
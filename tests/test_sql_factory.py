@@ -0,0 +1,84 @@
+import pytest
+
+from idli import sql_factory
+from idli.errors import InvalidFilterError
+from idli.internal import Column
+
+
+def render(composed):
+    return composed.as_string(None)
+
+
+def test_split_filter_key():
+    assert sql_factory.split_filter_key('status') == ('status', 'eq')
+    assert sql_factory.split_filter_key('status__ne') == ('status', 'ne')
+    assert sql_factory.split_filter_key('status__neq') == ('status', 'neq')
+    assert sql_factory.split_filter_key('due__date__lt') == ('due__date', 'lt')
+
+
+def test_split_filter_key_rejects_unknown_operator():
+    with pytest.raises(InvalidFilterError):
+        sql_factory.split_filter_key('status__nope')
+
+
+def test_in_uses_a_single_array_parameter():
+    condition, params = sql_factory.filter_condition('id', 'in', [1, 2, 3])
+    assert render(condition) == '"id" = ANY(%b)'
+    assert params == [[1, 2, 3]]
+
+
+def test_empty_in_matches_nothing():
+    condition, params = sql_factory.filter_condition('id', 'in', [])
+    assert render(condition) == 'FALSE'
+    assert params == []
+
+
+def test_isnull():
+    condition, params = sql_factory.filter_condition('updated', 'isnull', True)
+    assert render(condition) == '"updated" IS NULL'
+    condition, params = sql_factory.filter_condition('updated', 'isnull', False)
+    assert render(condition) == '"updated" IS NOT NULL'
+    assert params == []
+
+
+def test_like_and_between():
+    condition, params = sql_factory.filter_condition('title', 'ilike', '%orm%')
+    assert render(condition) == '"title" ILIKE %b'
+    assert params == ['%orm%']
+
+    condition, params = sql_factory.filter_condition('points', 'between', (1, 5))
+    assert render(condition) == '"points" BETWEEN %b AND %b'
+    assert params == [1, 5]
+
+
+def test_query_rows_collects_params_in_order():
+    query, params = sql_factory.query_rows(
+        table_name = 'task',
+        filters = {'status__in': ['todo'], 'points__between': (1, 5), 'updated__isnull': True},
+        limit = 10,
+        skip = 20,
+    )
+    assert render(query) == (
+        'SELECT * FROM "task" WHERE "status" = ANY(%b) AND "points" BETWEEN %b AND %b '
+        'AND "updated" IS NULL LIMIT %b OFFSET %b'
+    )
+    assert params == [['todo'], 1, 5, 10, 20]
+
+
+def test_query_rows_without_filters_has_no_where():
+    query, params = sql_factory.query_rows(table_name = 'task', filters = {})
+    assert render(query) == 'SELECT * FROM "task"'
+    assert params == []
+
+
+def test_query_rows_by_keys_sends_one_typed_array_per_key_column():
+    columns = [
+        Column('membership', 'team_id', 'INTEGER'),
+        Column('membership', 'user_id', 'UUID'),
+    ]
+    query, params = sql_factory.query_rows_by_keys('membership', columns, [(1, 'a'), (2, 'b'), (3, 'c')])
+    assert render(query) == (
+        'SELECT * FROM "membership" WHERE ("team_id", "user_id") '
+        'IN (SELECT * FROM unnest(%b::INTEGER[], %b::UUID[]))'
+    )
+    assert params == [[1, 2, 3], ['a', 'b', 'c']]